@@ -0,0 +1,330 @@
+# Замеры производительности без GUI: python main.py bench --scale 100000.
+# Синтетическая база строится детерминированно по (scale, seed) и кешируется между
+# запусками; замеры идут на копии, результаты пишутся в JSON для сравнения версий
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from warehouse import (Database, WarehouseService, REPORT_QUERIES, TABLE_VIEWS, view_query,
+                       product_search_filter, fill_daily_stats, fill_stock_ledger,
+                       create_stock_snapshots, logger)
+
+# Как SqlTableModel.PAGE_SIZE: вкладка главного окна читает первую страницу
+PAGE_SIZE = 200
+BATCH_DOCUMENTS = 5000
+# Каталог синтетических баз по умолчанию (в .gitignore)
+DATA_DIR = "bench_data"
+
+BASE_DATE = date(2023, 1, 1)
+DAYS = 730
+
+NOUNS = ["Болт", "Гайка", "Шайба", "Шуруп", "Цвях", "Кабель", "Розетка", "Вимикач",
+         "Лампа", "Фарба", "Труба", "Кран", "Фітинг", "Дюбель", "Хомут", "Клей"]
+KINDS = ["оцинкований", "нержавіючий", "посилений", "мідний", "білий", "чорний",
+         "універсальний", "промисловий", "побутовий", "монтажний"]
+SIZES = ["М6", "М8", "М10", "М12", "16 мм", "20 мм", "1/2", "3/4", "2.5 мм²", "10 л"]
+CATEGORIES = ["Кріплення", "Електрика", "Сантехніка", "Фарби", "Інструмент", "Освітлення"]
+
+def dataset_size(scale):
+    # scale - число строк документов (поступления + продажи)
+    products = max(100, min(scale // 50, 200000))
+    return {
+        "lines": scale,
+        "products": products,
+        "suppliers": max(10, products // 100),
+        "reservations": max(100, scale // 100),
+    }
+
+def _day(rnd):
+    return (BASE_DATE + timedelta(days=rnd.randrange(DAYS))).isoformat()
+
+def _documents(rnd, lines, products, prices, prefix, counterparty, max_quantity):
+    # Документы по ~10 строк, даты по возрастанию номера. Отдает пачки
+    # (документы, строки) по BATCH_DOCUMENTS документов
+    count = max(1, lines // 10)
+    days = sorted(_day(rnd) for _ in range(count))
+    line_id = 0
+    documents, items = [], []
+    for doc_id, day in enumerate(days, 1):
+        size = lines - line_id if doc_id == count else rnd.randint(1, 19)
+        size = max(1, min(size, lines - line_id - (count - doc_id)))
+        total = 0
+        for product_id in rnd.sample(range(1, products + 1), min(size, products)):
+            line_id += 1
+            quantity = rnd.randint(1, max_quantity)
+            price = prices[product_id - 1]
+            items.append((line_id, doc_id, product_id, quantity, price, round(quantity * price, 2)))
+            total += quantity * price
+        documents.append((doc_id, f"{prefix}-{doc_id:07d}", day, counterparty(), round(total, 2)))
+        if len(documents) >= BATCH_DOCUMENTS:
+            yield documents, items
+            documents, items = [], []
+    if documents:
+        yield documents, items
+
+def generate(path, scale, seed):
+    # Полная база склада: товары, поставщики, документы, резервы, затем счетчики
+    # остатков, дневные итоги, журнал движений и снимки - как после миграций
+    rnd = random.Random(seed)
+    size = dataset_size(scale)
+    db = Database(path, settings={"synchronous": "OFF", "checkpoint_interval": 0, "query_profile": 0})
+    conn = db.connection()
+    try:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO suppliers (id, name, contact_person, phone, email) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"Постачальник {i}", f"Менеджер {i}", f"+380{i:09d}", f"supplier{i}@example.com")
+             for i in range(1, size["suppliers"] + 1)))
+        
+        purchase_prices, retail_prices = [], []
+        products = []
+        for i in range(1, size["products"] + 1):
+            purchase = round(rnd.uniform(1, 500), 2)
+            retail = round(purchase * rnd.uniform(1.1, 1.6), 2)
+            purchase_prices.append(purchase)
+            retail_prices.append(retail)
+            name = f"{rnd.choice(NOUNS)} {rnd.choice(KINDS)} {rnd.choice(SIZES)} №{i}"
+            products.append((i, f"A{i:07d}", name, purchase, retail,
+                             f"Постачальник {rnd.randint(1, size['suppliers'])}",
+                             rnd.choice(CATEGORIES), rnd.randint(0, 20)))
+        conn.executemany('''
+            INSERT INTO products (id, article, name, purchase_price, retail_price,
+                                  supplier, category, min_stock)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', products)
+        
+        # Поступлений меньше, но строки крупнее - остатки в среднем положительные
+        receipt_lines = scale * 2 // 5
+        for documents, items in _documents(rnd, receipt_lines, size["products"], purchase_prices, "ПН",
+                                           lambda: rnd.randint(1, size["suppliers"]), 30):
+            conn.executemany('''
+                INSERT INTO receipts (id, document_number, receipt_date, supplier_id, total_amount)
+                VALUES (?, ?, ?, ?, ?)
+            ''', documents)
+            conn.executemany('''
+                INSERT INTO receipt_items (id, receipt_id, product_id, quantity, price, total)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', items)
+        for documents, items in _documents(rnd, scale - receipt_lines, size["products"], retail_prices, "ВН",
+                                           lambda: f"Клієнт {rnd.randint(1, 5000)}", 10):
+            conn.executemany('''
+                INSERT INTO sales (id, document_number, sale_date, client_name, total_amount)
+                VALUES (?, ?, ?, ?, ?)
+            ''', documents)
+            conn.executemany('''
+                INSERT INTO sale_items (id, sale_id, product_id, quantity, price, total)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', items)
+        
+        # Активны резервы последних двух недель периода, остальные закрыты
+        last_day = BASE_DATE + timedelta(days=DAYS - 1)
+        reservations = []
+        for i in range(1, size["reservations"] + 1):
+            day = date.fromisoformat(_day(rnd))
+            active = (last_day - day).days < 14
+            reservations.append((i, f"Клієнт {rnd.randint(1, 5000)}", rnd.randint(1, size["products"]),
+                                 rnd.randint(1, 5), day.isoformat(), (day + timedelta(days=14)).isoformat(),
+                                 "active" if active else rnd.choice(["completed", "cancelled", "expired"])))
+        conn.executemany('''
+            INSERT INTO reservations (id, client_name, product_id, quantity,
+                                      reservation_date, expiry_date, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', reservations)
+        
+        conn.execute('''
+            UPDATE products SET
+                current_stock = COALESCE((SELECT SUM(quantity) FROM receipt_items
+                                          WHERE product_id = products.id), 0)
+                              - COALESCE((SELECT SUM(quantity) FROM sale_items
+                                          WHERE product_id = products.id), 0),
+                reserved_qty = COALESCE((SELECT SUM(quantity) FROM reservations
+                                         WHERE product_id = products.id AND status = 'active'), 0)
+        ''')
+        fill_daily_stats(conn)
+        fill_stock_ledger(conn)
+        create_stock_snapshots(conn, (last_day.replace(day=1) - timedelta(days=1)).isoformat())
+        conn.commit()
+        
+        conn.execute("ANALYZE")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        db.close()
+    return size
+
+def prepare(data_dir, scale, seed):
+    # Шаблон базы строится один раз на (scale, seed), каждый запуск работает с копией
+    os.makedirs(data_dir, exist_ok=True)
+    template = os.path.join(data_dir, f"bench_{scale}_{seed}.db")
+    generated = None
+    if not os.path.exists(template):
+        started = time.perf_counter()
+        partial = template + ".part"
+        if os.path.exists(partial):
+            os.remove(partial)
+        generate(partial, scale, seed)
+        os.replace(partial, template)
+        generated = time.perf_counter() - started
+    
+    work = os.path.join(data_dir, f"bench_{scale}_{seed}.run.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(template, work)
+    return work, generated
+
+def measure(fn, repeat):
+    # Время в миллисекундах; первый прогон не отбрасывается - холодный кэш тоже важен
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "max_ms": round(max(times), 3),
+    }
+
+def benchmarks(service, conn):
+    # [(имя, функция)] - пути, которые пользователь ждет в GUI и терминалах
+    cases = []
+    
+    # Вкладки главного окна: первая страница в сортировке по умолчанию
+    for name, (source, columns, key, sort_column, descending) in TABLE_VIEWS.items():
+        sql = view_query(source, columns, key, sort_column, descending) + " LIMIT ? OFFSET ?"
+        cases.append((f"tab.{name}", lambda sql=sql: conn.execute(sql, (PAGE_SIZE, 0)).fetchall()))
+    
+    # Поиск товаров: фильтр вкладки "Товари" и подбор в диалогах/API
+    source, columns, key, sort_column, descending = TABLE_VIEWS["products"]
+    for label, text in (("word", "оцинкований"), ("short", "М8"), ("article", "A00001")):
+        where, params = product_search_filter(text, service.db.has_fts)
+        sql = view_query(source, columns, key, sort_column, descending, where) + " LIMIT ? OFFSET ?"
+        cases.append((f"search.tab.{label}",
+                      lambda sql=sql, params=params: conn.execute(sql, (*params, PAGE_SIZE, 0)).fetchall()))
+        cases.append((f"search.find.{label}", lambda text=text: service.find_products(text, 100, conn)))
+    
+    # Отчеты ReportsDialog: последний месяц и весь период
+    last_day = BASE_DATE + timedelta(days=DAYS - 1)
+    periods = {
+        "month": ((last_day - timedelta(days=30)).isoformat(), last_day.isoformat()),
+        "all": (BASE_DATE.isoformat(), last_day.isoformat()),
+    }
+    for name in REPORT_QUERIES:
+        if name == "stock":
+            cases.append(("report.stock", lambda: service.report("stock", conn=conn)))
+            middle = (BASE_DATE + timedelta(days=DAYS // 2)).isoformat()
+            cases.append(("report.stock.as_of", lambda: service.report("stock", as_of=middle, conn=conn)))
+            continue
+        for period, (date_from, date_to) in periods.items():
+            cases.append((f"report.{name}.{period}",
+                          lambda name=name, date_from=date_from, date_to=date_to:
+                              service.report(name, date_from, date_to, conn=conn)))
+    
+    cases.append(("verify_stock", lambda: service.verify_stock(conn)))
+    return cases
+
+def posting_benchmarks(service, conn):
+    # Проведение документов по 10 строк; для продаж - товары с наибольшим остатком
+    rows = conn.execute('''
+        SELECT id, purchase_price, retail_price FROM products
+        ORDER BY current_stock - reserved_qty DESC LIMIT 50
+    ''').fetchall()
+    rnd = random.Random(0)
+    supplier_id = conn.execute("SELECT MIN(id) FROM suppliers").fetchone()[0]
+    counter = iter(range(1, 1000000))
+    today = datetime.now().strftime("%Y-%m-%d")
+    
+    def items(price_index):
+        return [(row[0], 1, row[price_index]) for row in rnd.sample(rows, min(10, len(rows)))]
+    
+    def post_sale():
+        service.post_sale(f"BENCH-ВН-{next(counter)}", "Бенчмарк", "", today, items(2), conn)
+    
+    def post_receipt():
+        service.post_receipt(f"BENCH-ПН-{next(counter)}", supplier_id, today, items(1), conn)
+    
+    return [("post.sale", post_sale), ("post.receipt", post_receipt)]
+
+def compare(previous, current):
+    # Отношение медиан: > 1 - стало медленнее
+    for key in ("scale", "seed"):
+        if previous.get("meta", {}).get(key) != current["meta"][key]:
+            print(f"Увага: різні {key} ({previous.get('meta', {}).get(key)} і {current['meta'][key]}), "
+                  f"порівняння неточне", file=sys.stderr)
+    print(f"{'Замір':32} {'було, мс':>12} {'стало, мс':>12} {'x':>7}")
+    for name, result in current["results"].items():
+        old = previous.get("results", {}).get(name)
+        if old is None:
+            print(f"{name:32} {'-':>12} {result['median_ms']:12.2f} {'-':>7}")
+            continue
+        ratio = result["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+        mark = "  !" if ratio > 1.2 else ""
+        print(f"{name:32} {old['median_ms']:12.2f} {result['median_ms']:12.2f} {ratio:7.2f}{mark}")
+
+def run_bench(scale, seed=1, repeat=5, output=None, compare_with=None, data_dir=DATA_DIR, profile=False):
+    work, generated = prepare(data_dir, scale, seed)
+    if generated is not None:
+        print(f"Згенеровано базу на {scale} рядків документів за {generated:.1f} с")
+    
+    # Профилирование запросов добавляет свое время к замерам - только по запросу
+    db = Database(work, settings={"checkpoint_interval": 0, "query_profile": int(profile),
+                                  "slow_query_log": ""})
+    service = WarehouseService(db)
+    conn = db.connection()
+    results = {}
+    try:
+        for name, fn in benchmarks(service, conn) + posting_benchmarks(service, conn):
+            logger.info("Замір %s", name)
+            results[name] = measure(fn, repeat)
+            print(f"{name:32} {results[name]['median_ms']:12.2f} мс")
+        
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("products", "suppliers", "receipts", "receipt_items",
+                                "sales", "sale_items", "reservations")}
+        schema_version = db.schema_version()
+        queries = db.stats.snapshot()["statements"] if profile else None
+    finally:
+        db.close()
+    
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "scale": scale,
+            "seed": seed,
+            "repeat": repeat,
+            "schema_version": schema_version,
+            "sqlite_version": sqlite3.sqlite_version,
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "generate_seconds": round(generated, 3) if generated is not None else None,
+        },
+        "dataset": counts,
+        "results": results,
+    }
+    if queries is not None:
+        report["queries"] = queries
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результати записано у {output}")
+    
+    if compare_with:
+        with open(compare_with, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+if __name__ == "__main__":
+    from warehouse import run_command
+    sys.exit(run_command(["bench", *sys.argv[1:]]))
@@ -4,123 +4,27 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout,
                              QTableWidgetItem, QLineEdit, QLabel, QMessageBox,
                              QDialog, QFormLayout, QDoubleSpinBox, QHeaderView,
                              QTabWidget, QDateEdit, QSpinBox, QComboBox,
-                             QTextEdit)
-from PyQt5.QtCore import Qt, QDate
+                             QTextEdit, QTableView, QAbstractItemView, QCompleter,
+                             QFileDialog, QProgressDialog, QCheckBox)
+from PyQt5.QtCore import (Qt, QDate, QAbstractTableModel, QAbstractListModel,
+                          QModelIndex, QObject,
+                          QRunnable, QThreadPool, QTimer, pyqtSignal)
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 from PyQt5.QtGui import QTextDocument
-import sqlite3
+import logging
 import os
-from datetime import datetime, timedelta
+import re
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict, Counter, deque
+from datetime import datetime
 
-class Database:
-    def __init__(self):
-        self.db_name = "warehouse.db"
-        self.init_db()
-    
-    def init_db(self):
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        
-        # Таблица товаров
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                article TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                purchase_price REAL DEFAULT 0,
-                retail_price REAL DEFAULT 0,
-                supplier TEXT,
-                category TEXT,
-                min_stock INTEGER DEFAULT 0,
-                current_stock INTEGER DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица поставщиков
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS suppliers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                contact_person TEXT,
-                phone TEXT,
-                email TEXT,
-                address TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица поступлений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS receipts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                document_number TEXT NOT NULL,
-                supplier_id INTEGER,
-                receipt_date DATE NOT NULL,
-                total_amount REAL DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
-            )
-        ''')
-        
-        # Таблица строк поступлений
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS receipt_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                receipt_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER NOT NULL,
-                price REAL NOT NULL,
-                total REAL NOT NULL,
-                FOREIGN KEY (receipt_id) REFERENCES receipts (id),
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        # Таблица продаж (накладные)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                document_number TEXT NOT NULL,
-                client_name TEXT NOT NULL,
-                client_address TEXT,
-                sale_date DATE NOT NULL,
-                total_amount REAL DEFAULT 0,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица строк продаж
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sale_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sale_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER NOT NULL,
-                price REAL NOT NULL,
-                total REAL NOT NULL,
-                FOREIGN KEY (sale_id) REFERENCES sales (id),
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        # Таблица резервов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reservations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                client_name TEXT NOT NULL,
-                product_id INTEGER,
-                quantity INTEGER NOT NULL,
-                reservation_date DATE NOT NULL,
-                expiry_date DATE NOT NULL,
-                status TEXT DEFAULT 'active',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+from warehouse import (Database, WarehouseService, ValidationError, InsufficientStockError,
+                       REPORT_QUERIES, TABLE_VIEWS, report_params, view_query, export_query,
+                       product_search_filter, run_command, logger, db_settings_from_env,
+                       file_logger)
 
 class SupplierDialog(QDialog):
     def __init__(self, parent=None, supplier_data=None):
@@ -190,8 +94,11 @@ class SupplierDialog(QDialog):
         self.accept()
 
 class ReceiptDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, service, catalog, parent=None):
         super().__init__(parent)
+        self.service = service
+        self.catalog = catalog
+        self.catalog.refresh_if_changed()
         self.setup_ui()
         
     def setup_ui(self):
@@ -233,9 +140,11 @@ class ReceiptDialog(QDialog):
         item_buttons_layout = QHBoxLayout()
         self.add_item_btn = QPushButton("Додати товар")
         self.remove_item_btn = QPushButton("Видалити товар")
+        self.import_btn = QPushButton("📥 Імпорт з файлу")
         
         item_buttons_layout.addWidget(self.add_item_btn)
         item_buttons_layout.addWidget(self.remove_item_btn)
+        item_buttons_layout.addWidget(self.import_btn)
         item_buttons_layout.addStretch()
         
         layout.addLayout(item_buttons_layout)
@@ -259,6 +168,7 @@ class ReceiptDialog(QDialog):
         # Подключение сигналов
         self.add_item_btn.clicked.connect(self.add_item_row)
         self.remove_item_btn.clicked.connect(self.remove_item_row)
+        self.import_btn.clicked.connect(self.import_from_file)
         self.save_btn.clicked.connect(self.save_receipt)
         self.cancel_btn.clicked.connect(self.reject)
         
@@ -266,11 +176,7 @@ class ReceiptDialog(QDialog):
         self.add_item_row()
     
     def load_suppliers(self):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM suppliers ORDER BY name")
-        suppliers = cursor.fetchall()
-        conn.close()
+        suppliers = self.service.suppliers()
         
         self.supplier_combo.clear()
         self.supplier_combo.addItem("-- Оберіть постачальника --", 0)
@@ -281,9 +187,8 @@ class ReceiptDialog(QDialog):
         row = self.items_table.rowCount()
         self.items_table.insertRow(row)
         
-        # Комбобокс товаров
-        product_combo = QComboBox()
-        self.load_products_to_combo(product_combo)
+        # Комбобокс товаров (общий каталог, без повторного чтения БД)
+        product_combo = self.catalog.create_combo()
         
         quantity_input = QSpinBox()
         quantity_input.setMinimum(1)
@@ -307,18 +212,6 @@ class ReceiptDialog(QDialog):
         quantity_input.valueChanged.connect(self.calculate_totals)
         price_input.valueChanged.connect(self.calculate_totals)
     
-    def load_products_to_combo(self, combo):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, article, name FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-        
-        combo.clear()
-        combo.addItem("-- Оберіть товар --", 0)
-        for product in products:
-            combo.addItem(f"{product[1]} - {product[2]}", product[0])
-    
     def delete_row(self, row):
         self.items_table.removeRow(row)
         self.calculate_totals()
@@ -346,84 +239,93 @@ class ReceiptDialog(QDialog):
         self.total_label.setText(f"Разом: {total:.2f} грн")
     
     def save_receipt(self):
-        # Проверки
+        # Проверки и запись одной транзакцией - в WarehouseService
+        try:
+            self.service.post_receipt(
+                self.doc_number_input.text(),
+                self.supplier_combo.currentData(),
+                self.date_input.date().toString('yyyy-MM-dd'),
+                self.collect_items()
+            )
+            QMessageBox.information(self, "Успіх", "Надходження успішно проведено!")
+            self.accept()
+            
+        except ValidationError as e:
+            QMessageBox.warning(self, "Помилка", str(e))
+        except Exception as e:
+            QMessageBox.critical(self, "Помилка", f"Помилка при збереженні: {str(e)}")
+    
+    def import_from_file(self):
+        # Накладная поставщика из файла проводится сразу, минуя построчные виджеты:
+        # шапка документа берется из полей диалога
         if self.supplier_combo.currentData() == 0:
             QMessageBox.warning(self, "Помилка", "Оберіть постачальника!")
             return
         
-        # Проверяем что есть товары
-        has_items = False
-        for row in range(self.items_table.rowCount()):
-            product_combo = self.items_table.cellWidget(row, 0)
-            if product_combo.currentData() != 0:
-                has_items = True
-                break
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Імпорт надходження", "", "Накладна (*.csv *.txt *.xlsx);;CSV (*.csv *.txt);;Excel (*.xlsx)")
+        if not path:
+            return
         
-        if not has_items:
-            QMessageBox.warning(self, "Помилка", "Додайте хоча б один товар!")
+        try:
+            items, errors = self.service.read_receipt_items(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Помилка", f"Помилка читання файлу: {str(e)}")
             return
         
-        # Сохраняем в базу
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
+        if errors:
+            message = QMessageBox(self)
+            message.setIcon(QMessageBox.Warning)
+            message.setWindowTitle("Імпорт надходження")
+            message.setText(f"Рядків з помилками: {len(errors)}. Надходження не проведено.")
+            lines = [f"Рядок {line_no}: {error}" for line_no, error in errors[:1000]]
+            if len(errors) > 1000:
+                lines.append(f"... і ще {len(errors) - 1000}")
+            message.setDetailedText("\n".join(lines))
+            message.exec_()
+            return
+        if not items:
+            QMessageBox.warning(self, "Помилка", "У файлі немає товарів!")
+            return
+        
+        total = sum(quantity * price for _, quantity, price in items)
+        answer = QMessageBox.question(
+            self, "Імпорт надходження",
+            f"Провести надходження: позицій {len(items)} на суму {total:.2f} грн?",
+            QMessageBox.Yes | QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return
         
         try:
-            # Создаем заголовок поступления
-            cursor.execute('''
-                INSERT INTO receipts (document_number, supplier_id, receipt_date, total_amount)
-                VALUES (?, ?, ?, ?)
-            ''', (
+            self.service.post_receipt(
                 self.doc_number_input.text(),
                 self.supplier_combo.currentData(),
                 self.date_input.date().toString('yyyy-MM-dd'),
-                0  # Пока 0, посчитаем ниже
-            ))
-            
-            receipt_id = cursor.lastrowid
-            total_amount = 0.0
-            
-            # Сохраняем строки
-            for row in range(self.items_table.rowCount()):
-                product_combo = self.items_table.cellWidget(row, 0)
-                quantity_widget = self.items_table.cellWidget(row, 1)
-                price_widget = self.items_table.cellWidget(row, 2)
-                
-                if product_combo.currentData() != 0:
-                    product_id = product_combo.currentData()
-                    quantity = quantity_widget.value()
-                    price = price_widget.value()
-                    row_total = quantity * price
-                    total_amount += row_total
-                    
-                    cursor.execute('''
-                        INSERT INTO receipt_items (receipt_id, product_id, quantity, price, total)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (receipt_id, product_id, quantity, price, row_total))
-                    
-                    # Обновляем залишки товара
-                    cursor.execute('''
-                        UPDATE products SET current_stock = current_stock + ? 
-                        WHERE id = ?
-                    ''', (quantity, product_id))
-            
-            # Обновляем общую сумму
-            cursor.execute('''
-                UPDATE receipts SET total_amount = ? WHERE id = ?
-            ''', (total_amount, receipt_id))
-            
-            conn.commit()
+                items
+            )
             QMessageBox.information(self, "Успіх", "Надходження успішно проведено!")
             self.accept()
             
         except Exception as e:
-            conn.rollback()
             QMessageBox.critical(self, "Помилка", f"Помилка при збереженні: {str(e)}")
-        finally:
-            conn.close()
+    
+    def collect_items(self):
+        items = []
+        for row in range(self.items_table.rowCount()):
+            product_combo = self.items_table.cellWidget(row, 0)
+            quantity_widget = self.items_table.cellWidget(row, 1)
+            price_widget = self.items_table.cellWidget(row, 2)
+            
+            if product_combo.currentData() != 0:
+                items.append((product_combo.currentData(), quantity_widget.value(), price_widget.value()))
+        return items
 
 class SaleDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, service, catalog, parent=None):
         super().__init__(parent)
+        self.service = service
+        self.catalog = catalog
+        self.catalog.refresh_if_changed()
         self.setup_ui()
         
     def setup_ui(self):
@@ -508,9 +410,8 @@ class SaleDialog(QDialog):
         row = self.items_table.rowCount()
         self.items_table.insertRow(row)
         
-        # Комбобокс товаров
-        product_combo = QComboBox()
-        self.load_products_to_combo(product_combo)
+        # Комбобокс товаров (общий каталог, без повторного чтения БД)
+        product_combo = self.catalog.create_combo()
         
         quantity_input = QSpinBox()
         quantity_input.setMinimum(1)
@@ -538,29 +439,14 @@ class SaleDialog(QDialog):
         quantity_input.valueChanged.connect(self.calculate_totals)
         price_input.valueChanged.connect(self.calculate_totals)
     
-    def load_products_to_combo(self, combo):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, article, name, current_stock, retail_price FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-        
-        combo.clear()
-        combo.addItem("-- Оберіть товар --", 0)
-        for product in products:
-            combo.addItem(f"{product[1]} - {product[2]} ({product[3]} шт.)", product[0])
-            # Сохраняем цену и количество в userData
-            combo.setItemData(combo.count()-1, product[3], Qt.UserRole)  # available stock
-            combo.setItemData(combo.count()-1, product[4], Qt.UserRole+1)  # retail price
-    
     def update_available_stock(self, row):
         product_combo = self.items_table.cellWidget(row, 0)
         available_label = self.items_table.cellWidget(row, 2)
         price_input = self.items_table.cellWidget(row, 3)
         
         if product_combo.currentData() != 0:
-            available_stock = product_combo.currentData(Qt.UserRole) or 0
-            retail_price = product_combo.currentData(Qt.UserRole+1) or 0
+            available_stock = product_combo.currentData(ProductCatalogModel.StockRole) or 0
+            retail_price = product_combo.currentData(ProductCatalogModel.PriceRole) or 0
             
             available_label.setText(str(available_stock))
             price_input.setValue(retail_price)
@@ -594,96 +480,42 @@ class SaleDialog(QDialog):
         self.total_label.setText(f"Разом: {total:.2f} грн")
     
     def save_sale(self):
-        # Проверки
-        if not self.client_input.text().strip():
-            QMessageBox.warning(self, "Помилка", "Введіть ім'я клієнта!")
-            return
-        
-        # Проверяем что есть товары
-        has_items = False
-        for row in range(self.items_table.rowCount()):
-            product_combo = self.items_table.cellWidget(row, 0)
-            if product_combo.currentData() != 0:
-                has_items = True
-                break
-        
-        if not has_items:
-            QMessageBox.warning(self, "Помилка", "Додайте хоча б один товар!")
-            return
-        
-        # Проверяем доступность товаров
-        for row in range(self.items_table.rowCount()):
-            product_combo = self.items_table.cellWidget(row, 0)
-            quantity_widget = self.items_table.cellWidget(row, 1)
-            available_label = self.items_table.cellWidget(row, 2)
-            
-            if product_combo.currentData() != 0:
-                requested = quantity_widget.value()
-                available = int(available_label.text())
-                if requested > available:
-                    QMessageBox.warning(self, "Помилка", 
-                                      f"Недостатньо товару на складі!\n"
-                                      f"Запитується: {requested}, Наявно: {available}")
-                    return
-        
-        # Сохраняем в базу
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        
+        # Проверки и запись одной транзакцией - в WarehouseService
         try:
-            # Создаем заголовок продажи
-            cursor.execute('''
-                INSERT INTO sales (document_number, client_name, client_address, sale_date, total_amount)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
+            self.service.post_sale(
                 self.doc_number_input.text(),
-                self.client_input.text().strip(),
+                self.client_input.text(),
                 self.address_input.text(),
                 self.date_input.date().toString('yyyy-MM-dd'),
-                0  # Пока 0, посчитаем ниже
-            ))
-            
-            sale_id = cursor.lastrowid
-            total_amount = 0.0
-            
-            # Сохраняем строки
-            for row in range(self.items_table.rowCount()):
-                product_combo = self.items_table.cellWidget(row, 0)
-                quantity_widget = self.items_table.cellWidget(row, 1)
-                price_widget = self.items_table.cellWidget(row, 3)
-                
-                if product_combo.currentData() != 0:
-                    product_id = product_combo.currentData()
-                    quantity = quantity_widget.value()
-                    price = price_widget.value()
-                    row_total = quantity * price
-                    total_amount += row_total
-                    
-                    cursor.execute('''
-                        INSERT INTO sale_items (sale_id, product_id, quantity, price, total)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (sale_id, product_id, quantity, price, row_total))
-                    
-                    # Обновляем залишки товара
-                    cursor.execute('''
-                        UPDATE products SET current_stock = current_stock - ? 
-                        WHERE id = ?
-                    ''', (quantity, product_id))
-            
-            # Обновляем общую сумму
-            cursor.execute('''
-                UPDATE sales SET total_amount = ? WHERE id = ?
-            ''', (total_amount, sale_id))
-            
-            conn.commit()
+                self.collect_items()
+            )
             QMessageBox.information(self, "Успіх", "Накладна успішно проведена!")
             self.accept()
             
+        except ValidationError as e:
+            QMessageBox.warning(self, "Помилка", str(e))
+        except InsufficientStockError as e:
+            # Наличие проверено в момент проведения, показываем строки, которых не хватило
+            lines = []
+            for product_id, article, name, requested, available in e.shortages:
+                rows = [str(row + 1) for row in range(self.items_table.rowCount())
+                        if self.items_table.cellWidget(row, 0).currentData() == product_id]
+                lines.append(f"Рядок {', '.join(rows)}: {article} - {name}\n"
+                             f"Запитується: {requested}, Наявно: {available}")
+            QMessageBox.warning(self, "Помилка", "Недостатньо товару на складі!\n\n" + "\n".join(lines))
         except Exception as e:
-            conn.rollback()
             QMessageBox.critical(self, "Помилка", f"Помилка при збереженні: {str(e)}")
-        finally:
-            conn.close()
+    
+    def collect_items(self):
+        items = []
+        for row in range(self.items_table.rowCount()):
+            product_combo = self.items_table.cellWidget(row, 0)
+            quantity_widget = self.items_table.cellWidget(row, 1)
+            price_widget = self.items_table.cellWidget(row, 3)
+            
+            if product_combo.currentData() != 0:
+                items.append((product_combo.currentData(), quantity_widget.value(), price_widget.value()))
+        return items
     
     def print_invoice(self):
         # Создаем HTML для печати
@@ -774,8 +606,11 @@ class SaleDialog(QDialog):
             document.print_(printer)
 
 class ReservationDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, service, catalog, parent=None):
         super().__init__(parent)
+        self.service = service
+        self.catalog = catalog
+        self.catalog.refresh_if_changed()
         self.setup_ui()
         
     def setup_ui(self):
@@ -787,8 +622,7 @@ class ReservationDialog(QDialog):
         self.client_input = QLineEdit()
         self.client_input.setPlaceholderText("ПІБ або назва клієнта")
         
-        self.product_combo = QComboBox()
-        self.load_products()
+        self.product_combo = self.catalog.create_combo()
         
         self.quantity_input = QSpinBox()
         self.quantity_input.setMinimum(1)
@@ -828,70 +662,100 @@ class ReservationDialog(QDialog):
         self.save_btn.clicked.connect(self.save_reservation)
         self.cancel_btn.clicked.connect(self.reject)
     
-    def load_products(self):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, article, name, current_stock FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-        
-        self.product_combo.clear()
-        self.product_combo.addItem("-- Оберіть товар --", 0)
-        for product in products:
-            self.product_combo.addItem(f"{product[1]} - {product[2]}", product[0])
-            self.product_combo.setItemData(self.product_combo.count()-1, product[3], Qt.UserRole)
-    
     def update_available_stock(self):
         if self.product_combo.currentData() != 0:
-            available_stock = self.product_combo.currentData(Qt.UserRole) or 0
+            available_stock = self.product_combo.currentData(ProductCatalogModel.StockRole) or 0
             self.available_label.setText(str(available_stock))
     
     def save_reservation(self):
-        if not self.client_input.text().strip():
-            QMessageBox.warning(self, "Помилка", "Введіть ім'я клієнта!")
-            return
-        
-        if self.product_combo.currentData() == 0:
-            QMessageBox.warning(self, "Помилка", "Оберіть товар!")
-            return
-        
-        available_stock = self.product_combo.currentData(Qt.UserRole) or 0
-        requested = self.quantity_input.value()
-        
-        if requested > available_stock:
-            QMessageBox.warning(self, "Помилка", 
-                              f"Недостатньо товару на складі!\n"
-                              f"Запитується: {requested}, Наявно: {available_stock}")
-            return
-        
-        # Сохраняем в базу
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        
+        # Доступность проверяется в транзакции резервирования, а не по кешу каталога
         try:
-            cursor.execute('''
-                INSERT INTO reservations (client_name, product_id, quantity, reservation_date, expiry_date)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                self.client_input.text().strip(),
+            self.service.reserve(
+                self.client_input.text(),
                 self.product_combo.currentData(),
-                requested,
+                self.quantity_input.value(),
                 self.reservation_date.date().toString('yyyy-MM-dd'),
                 self.expiry_date.date().toString('yyyy-MM-dd')
-            ))
-            
-            conn.commit()
+            )
             QMessageBox.information(self, "Успіх", "Товар успішно зарезервовано!")
             self.accept()
             
+        except ValidationError as e:
+            QMessageBox.warning(self, "Помилка", str(e))
+        except InsufficientStockError as e:
+            _, _, _, requested, available = e.shortages[0]
+            QMessageBox.warning(self, "Помилка", 
+                              f"Недостатньо товару на складі!\n"
+                              f"Запитується: {requested}, Доступно: {available}")
         except Exception as e:
             QMessageBox.critical(self, "Помилка", f"Помилка при збереженні: {str(e)}")
-        finally:
-            conn.close()
+
+def export_with_progress(parent, executor, sql, params, headers, file_name):
+    # Спрашивает файл и выгружает выборку в фоне; окно прогресса позволяет отменить
+    path, selected_filter = QFileDialog.getSaveFileName(
+        parent, "Експорт", file_name, "CSV (*.csv);;Excel (*.xlsx)")
+    if not path:
+        return None
+    if not path.lower().endswith((".csv", ".xlsx")):
+        path += ".xlsx" if "xlsx" in selected_filter else ".csv"
+    
+    # Без заранее известного числа строк - бегущий индикатор и счетчик выгруженного
+    progress = QProgressDialog("Експорт даних...", "Скасувати", 0, 0, parent)
+    progress.setWindowModality(Qt.WindowModal)
+    progress.setMinimumDuration(0)
+    
+    def on_finished(count):
+        progress.reset()
+        QMessageBox.information(parent, "Успіх", f"Експортовано рядків: {count}\n{path}")
+    
+    def on_failed(error):
+        progress.reset()
+        QMessageBox.warning(parent, "Помилка", f"Помилка при експорті: {error}")
+    
+    job = executor.submit(
+        fn=lambda conn, job: export_query(conn, sql, params, headers, path, job),
+        on_result=on_finished, on_error=on_failed,
+        on_progress=lambda count: progress.setLabelText(f"Експорт даних... вивантажено {count}"))
+    progress.canceled.connect(job.cancel)
+    return job
+
+class ReportCache:
+    # LRU готовых отчетов по ключу (отчет, date_from, date_to, версия данных).
+    # После любой записи версия меняется, и старые результаты просто вытесняются
+    def __init__(self, max_entries=16, max_rows=500000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows  # суммарно по всем отчетам
+        self._entries = OrderedDict()
+        self._rows = 0
+    
+    def get(self, key):
+        rows = self._entries.get(key)
+        if rows is not None:
+            self._entries.move_to_end(key)
+        return rows
+    
+    def put(self, key, rows):
+        if len(rows) > self.max_rows:
+            return
+        if key in self._entries:
+            self._rows -= len(self._entries.pop(key))
+        self._entries[key] = rows
+        self._rows += len(rows)
+        while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+            _, evicted = self._entries.popitem(last=False)
+            self._rows -= len(evicted)
 
 class ReportsDialog(QDialog):
-    def __init__(self, parent=None):
+    # Отчеты считаются в фоне через QueryExecutor, окно остается отзывчивым.
+    # Вкладка формируется при первом показе, готовые результаты берутся из кэша
+    def __init__(self, service, executor, cache, parent=None):
         super().__init__(parent)
+        self.service = service
+        self.db = service.db
+        self.executor = executor
+        self.cache = cache
+        self.jobs = {}   # отчет -> (ключ, выполняющееся задание)
+        self.shown = {}  # отчет -> ключ показанного результата
         self.setup_ui()
         
     def setup_ui(self):
@@ -913,7 +777,14 @@ class ReportsDialog(QDialog):
         self.date_to.setCalendarPopup(True)
         
         self.generate_btn = QPushButton("Сформувати звіт")
+        self.stop_btn = QPushButton("Зупинити")
+        self.stop_btn.setEnabled(False)
+        self.export_btn = QPushButton("Експорт...")
+        self.status_label = QLabel()
         period_layout.addWidget(self.generate_btn)
+        period_layout.addWidget(self.stop_btn)
+        period_layout.addWidget(self.export_btn)
+        period_layout.addWidget(self.status_label)
         period_layout.addStretch()
         
         layout.addLayout(period_layout)
@@ -933,142 +804,180 @@ class ReportsDialog(QDialog):
         self.sales_tab = QWidget()
         self.setup_sales_tab()
         
+        # Підсумки по товарах
+        self.summary_tab = QWidget()
+        self.setup_summary_tab()
+        
         self.report_tabs.addTab(self.stock_tab, "Залишки")
         self.report_tabs.addTab(self.movement_tab, "Рух товару")
         self.report_tabs.addTab(self.sales_tab, "Продажі")
+        self.report_tabs.addTab(self.summary_tab, "Підсумки")
         
         layout.addWidget(self.report_tabs)
         self.setLayout(layout)
         
         # Подключение сигналов
         self.generate_btn.clicked.connect(self.generate_reports)
+        self.stop_btn.clicked.connect(self.cancel_reports)
+        self.export_btn.clicked.connect(self.export_report)
+        self.report_tabs.currentChanged.connect(self.generate_reports)
         
-        # Генерируем отчет при открытии
+        # Генерируем отчет открытой вкладки
         self.generate_reports()
     
-    def setup_stock_tab(self):
+    def create_report_table(self, tab, report):
         layout = QVBoxLayout()
-        self.stock_table = QTableWidget()
-        layout.addWidget(self.stock_table)
-        self.stock_tab.setLayout(layout)
+        model = ListTableModel(REPORT_QUERIES[report][0], self)
+        table = QTableView()
+        table.setModel(model)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(table)
+        tab.setLayout(layout)
+        return table, model
+    
+    def setup_stock_tab(self):
+        self.stock_table, self.stock_model = self.create_report_table(self.stock_tab, "stock")
+        
+        # Остатки на прошедшую дату считаются по журналу движений
+        as_of_layout = QHBoxLayout()
+        self.as_of_check = QCheckBox("Станом на:")
+        self.as_of_date = QDateEdit()
+        self.as_of_date.setDate(QDate.currentDate())
+        self.as_of_date.setCalendarPopup(True)
+        self.as_of_date.setEnabled(False)
+        as_of_layout.addWidget(self.as_of_check)
+        as_of_layout.addWidget(self.as_of_date)
+        as_of_layout.addStretch()
+        self.stock_tab.layout().insertLayout(0, as_of_layout)
+        
+        self.as_of_check.toggled.connect(self.as_of_date.setEnabled)
+        self.as_of_check.toggled.connect(self.generate_reports)
+        self.as_of_date.dateChanged.connect(self.generate_reports)
+    
+    def stock_as_of(self):
+        if not self.as_of_check.isChecked():
+            return None
+        return self.as_of_date.date().toString('yyyy-MM-dd')
     
     def setup_movement_tab(self):
-        layout = QVBoxLayout()
-        self.movement_table = QTableWidget()
-        layout.addWidget(self.movement_table)
-        self.movement_tab.setLayout(layout)
+        self.movement_table, self.movement_model = self.create_report_table(self.movement_tab, "movement")
     
     def setup_sales_tab(self):
-        layout = QVBoxLayout()
-        self.sales_table = QTableWidget()
-        layout.addWidget(self.sales_table)
-        self.sales_tab.setLayout(layout)
+        self.sales_table, self.sales_model = self.create_report_table(self.sales_tab, "sales")
+    
+    def setup_summary_tab(self):
+        self.summary_table, self.summary_model = self.create_report_table(self.summary_tab, "summary")
     
     def generate_reports(self):
+        # Формируется только открытая вкладка, остальные - при переходе на них
         date_from = self.date_from.date().toString('yyyy-MM-dd')
         date_to = self.date_to.date().toString('yyyy-MM-dd')
         
-        self.generate_stock_report()
-        self.generate_movement_report(date_from, date_to)
-        self.generate_sales_report(date_from, date_to)
+        tab = self.report_tabs.currentWidget()
+        if tab is self.stock_tab:
+            self.generate_stock_report()
+        elif tab is self.movement_tab:
+            self.generate_movement_report(date_from, date_to)
+        elif tab is self.sales_tab:
+            self.generate_sales_report(date_from, date_to)
+        elif tab is self.summary_tab:
+            self.generate_summary_report(date_from, date_to)
+    
+    def export_report(self):
+        # Выгружается открытый отчет за выбранный период прямо из БД,
+        # без ограничения размером таблицы на экране
+        tab = self.report_tabs.currentWidget()
+        report = {self.stock_tab: "stock", self.movement_tab: "movement",
+                  self.sales_tab: "sales", self.summary_tab: "summary"}[tab]
+        params = report_params(
+            self.date_from.date().toString('yyyy-MM-dd'),
+            self.date_to.date().toString('yyyy-MM-dd'),
+            self.stock_as_of())
+        if report == "stock":
+            file_name = f"stock_{params['as_of'] or QDate.currentDate().toString('yyyy-MM-dd')}.csv"
+        else:
+            file_name = f"{report}_{params['date_from']}_{params['date_to']}.csv"
+        headers, sql = REPORT_QUERIES[report]
+        export_with_progress(self, self.executor, sql, params, headers, file_name)
     
     def generate_stock_report(self):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT article, name, category, current_stock, retail_price,
-                   (current_stock * retail_price) as total_value
-            FROM products 
-            ORDER BY name
-        ''')
-        
-        products = cursor.fetchall()
-        conn.close()
-        
-        self.stock_table.setColumnCount(6)
-        self.stock_table.setHorizontalHeaderLabels([
-            "Артикул", "Назва", "Категорія", "Залишок", "Ціна", "Загальна вартість"
-        ])
-        
-        self.stock_table.setRowCount(len(products))
-        
-        for row, product in enumerate(products):
-            for col, value in enumerate(product):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.stock_table.setItem(row, col, item)
+        self.run_report("stock", self.stock_model, {"as_of": self.stock_as_of()})
     
     def generate_movement_report(self, date_from, date_to):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 'Надходження' as type, r.document_number, r.receipt_date as date,
-                   p.article, p.name, ri.quantity, ri.price, s.name as counterparty
-            FROM receipt_items ri
-            JOIN receipts r ON ri.receipt_id = r.id
-            JOIN products p ON ri.product_id = p.id
-            LEFT JOIN suppliers s ON r.supplier_id = s.id
-            WHERE r.receipt_date BETWEEN ? AND ?
-            
-            UNION ALL
-            
-            SELECT 'Продаж' as type, s.document_number, s.sale_date as date,
-                   p.article, p.name, si.quantity, si.price, s.client_name as counterparty
-            FROM sale_items si
-            JOIN sales s ON si.sale_id = s.id
-            JOIN products p ON si.product_id = p.id
-            WHERE s.sale_date BETWEEN ? AND ?
-            
-            ORDER BY date DESC
-        ''', (date_from, date_to, date_from, date_to))
-        
-        movements = cursor.fetchall()
-        conn.close()
-        
-        self.movement_table.setColumnCount(8)
-        self.movement_table.setHorizontalHeaderLabels([
-            "Тип", "Номер", "Дата", "Артикул", "Товар", "Кількість", "Ціна", "Контрагент"
-        ])
-        
-        self.movement_table.setRowCount(len(movements))
-        
-        for row, movement in enumerate(movements):
-            for col, value in enumerate(movement):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.movement_table.setItem(row, col, item)
+        self.run_report("movement", self.movement_model,
+                        {"date_from": date_from, "date_to": date_to})
     
     def generate_sales_report(self, date_from, date_to):
-        conn = sqlite3.connect("warehouse.db")
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT s.document_number, s.sale_date, s.client_name, 
-                   COUNT(si.id) as items_count, s.total_amount
-            FROM sales s
-            LEFT JOIN sale_items si ON s.id = si.sale_id
-            WHERE s.sale_date BETWEEN ? AND ?
-            GROUP BY s.id
-            ORDER BY s.sale_date DESC
-        ''', (date_from, date_to))
-        
-        sales = cursor.fetchall()
-        conn.close()
-        
-        self.sales_table.setColumnCount(5)
-        self.sales_table.setHorizontalHeaderLabels([
-            "Номер", "Дата", "Клієнт", "Кількість позицій", "Сума"
-        ])
+        self.run_report("sales", self.sales_model,
+                        {"date_from": date_from, "date_to": date_to})
+    
+    def generate_summary_report(self, date_from, date_to):
+        self.run_report("summary", self.summary_model,
+                        {"date_from": date_from, "date_to": date_to})
+    
+    def run_report(self, report, model, params):
+        key = (report, params.get("date_from"), params.get("date_to"), params.get("as_of"),
+               self.db.data_version())
+        if self.shown.get(report) == key:
+            return
         
-        self.sales_table.setRowCount(len(sales))
+        rows = self.cache.get(key)
+        if rows is not None:
+            self.show_rows(report, model, key, rows)
+            return
         
-        for row, sale in enumerate(sales):
-            for col, value in enumerate(sale):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.sales_table.setItem(row, col, item)
+        running = self.jobs.get(report)
+        if running is not None:
+            if running[0] == key:
+                return
+            running[1].cancel()
+        
+        job = self.executor.submit(
+            fn=lambda conn, job: self.service.report(
+                report, params.get("date_from"), params.get("date_to"), params.get("as_of"),
+                conn, job)[1],
+            on_result=lambda rows: self.on_report_finished(report, model, key, rows),
+            on_error=lambda error: self.on_report_failed(report, error),
+            on_progress=lambda count: self.on_report_progress(report, count))
+        self.jobs[report] = (key, job)
+        self.update_status()
+    
+    def show_rows(self, report, model, key, rows):
+        model.set_rows(rows)
+        self.shown[report] = key
+    
+    def on_report_progress(self, report, count):
+        self.update_status(f"прочитано {count} рядків")
+    
+    def on_report_finished(self, report, model, key, rows):
+        self.jobs.pop(report, None)
+        self.cache.put(key, rows)
+        self.show_rows(report, model, key, rows)
+        self.update_status()
+    
+    def on_report_failed(self, report, error):
+        self.jobs.pop(report, None)
+        self.update_status()
+        QMessageBox.warning(self, "Помилка", f"Помилка при формуванні звіту: {error}")
+    
+    def cancel_reports(self):
+        for _, job in self.jobs.values():
+            job.cancel()
+        self.jobs.clear()
+        self.update_status()
+    
+    def update_status(self, detail=""):
+        self.stop_btn.setEnabled(bool(self.jobs))
+        if self.jobs:
+            text = f"Формується звітів: {len(self.jobs)}"
+            self.status_label.setText(f"{text}, {detail}" if detail else text)
+        else:
+            self.status_label.setText("")
+    
+    def done(self, result):
+        # Незавершенные отчеты больше не нужны
+        self.cancel_reports()
+        super().done(result)
 
 class ProductDialog(QDialog):
     def __init__(self, parent=None, product_data=None):
@@ -1143,13 +1052,935 @@ class ProductDialog(QDialog):
         )
         self.accept()
 
+class ProductCatalogModel(QAbstractListModel):
+    # Каталог товаров в памяти, общий для комбобоксов всех диалогов документов.
+    # Перечитывается только если база изменилась (Database.data_version).
+    # StockRole - доступное количество (остаток за вычетом резервов)
+    IdRole = Qt.UserRole
+    StockRole = Qt.UserRole + 1
+    PriceRole = Qt.UserRole + 2
+    
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self._products = []
+        self._rows = {}  # id товара -> номер строки
+        self._version = None
+    
+    def refresh_if_changed(self):
+        version = self.db.data_version()
+        if version == self._version:
+            return
+        
+        cursor = self.db.connection().cursor()
+        cursor.execute('''
+            SELECT id, article, name, current_stock - reserved_qty, retail_price
+            FROM products ORDER BY name
+        ''')
+        
+        self.beginResetModel()
+        # Первая строка - заглушка с id 0, как раньше в комбобоксах
+        self._products = [(0, None, "-- Оберіть товар --", 0, 0)] + cursor.fetchall()
+        self._rows = {product[0]: row for row, product in enumerate(self._products)}
+        self._version = version
+        self.endResetModel()
+    
+    def invalidate(self):
+        # Перечитать весь список при следующем открытии документа
+        self._version = None
+    
+    def update_stock(self, product_ids):
+        # После проведения документа перечитываются остатки только затронутых товаров.
+        # Если тем временем писали другие соединения, весь список перечитается позже
+        if self._version is None or self.db.data_version()[0] != self._version[0]:
+            return
+        
+        ids = [product_id for product_id in set(product_ids) if product_id in self._rows]
+        cursor = self.db.connection().cursor()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor.execute(f"SELECT id, current_stock - reserved_qty FROM products "
+                           f"WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            for product_id, stock in cursor.fetchall():
+                row = self._rows[product_id]
+                product = self._products[row]
+                self._products[row] = (*product[:3], stock, product[4])
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [self.StockRole])
+        self._version = self.db.data_version()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._products)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        
+        product_id, article, name, stock, price = self._products[index.row()]
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return f"{article} - {name}" if product_id else name
+        if role == self.IdRole:
+            return product_id
+        if role == self.StockRole:
+            return stock
+        if role == self.PriceRole:
+            return price
+        return None
+    
+    def create_combo(self):
+        # Комбобокс поверх общей модели: строка добавляется за O(1),
+        # товар можно найти вводом части артикула или названия
+        combo = QComboBox()
+        combo.setModel(self)
+        combo.setEditable(True)
+        combo.setInsertPolicy(QComboBox.NoInsert)
+        combo.view().setUniformItemSizes(True)
+        
+        completer = QCompleter(self, combo)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        completer.setFilterMode(Qt.MatchContains)
+        completer.setCompletionMode(QCompleter.PopupCompletion)
+        combo.setCompleter(completer)
+        return combo
+
+class SqlTableModel(QAbstractTableModel):
+    # Модель только для чтения поверх произвольного SELECT.
+    # Строки подгружаются страницами по мере прокрутки (canFetchMore/fetchMore),
+    # в памяти держится не больше MAX_PAGES страниц, остальные перечитываются,
+    # поэтому расход памяти не зависит от размера истории.
+    # С executor страницы читаются в фоне и вставляются по приходу результата
+    PAGE_SIZE = 200
+    MAX_PAGES = 25
+    
+    failed = pyqtSignal(str)
+    
+    def __init__(self, db, source, columns, key="id", sort_column=0,
+                 sort_order=Qt.AscendingOrder, executor=None, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.executor = executor
+        self.source = source      # FROM ... [JOIN ...]
+        self.columns = columns    # [(заголовок, SQL-выражение)]
+        self.key = key            # уникальный ключ строки, первая колонка выборки
+        self.sort_column = sort_column
+        self.sort_order = sort_order
+        self._where = ""
+        self._params = ()
+        self._pages = OrderedDict()
+        self._row_count = 0
+        self._at_end = True
+        self._fetching = False
+        self._pending_pages = set()
+        self._generation = 0  # растет при сбросе, устаревшие ответы отбрасываются
+        self.loaded = False
+    
+    @classmethod
+    def from_view(cls, db, name, executor=None, parent=None):
+        # Модель по описанию таблицы из TABLE_VIEWS
+        source, columns, key, sort_column, descending = TABLE_VIEWS[name]
+        return cls(db, source, columns, key, sort_column,
+                   Qt.DescendingOrder if descending else Qt.AscendingOrder, executor, parent)
+    
+    def query(self, where=None, params=()):
+        # SELECT модели без LIMIT с текущим или переданным условием
+        if where is None:
+            where, params = self._where, self._params
+        
+        sql = view_query(self.source, self.columns, self.key, self.sort_column,
+                         self.sort_order == Qt.DescendingOrder, where)
+        return sql, tuple(params)
+    
+    def _page_query(self, offset, limit):
+        sql, params = self.query()
+        return sql + " LIMIT ? OFFSET ?", (*params, limit, offset)
+    
+    def _query(self, offset, limit):
+        sql, params = self._page_query(offset, limit)
+        return self.db.connection().execute(sql, params).fetchall()
+    
+    def _store_page(self, page_no, rows):
+        self._pages[page_no] = rows
+        self._pages.move_to_end(page_no)
+        while len(self._pages) > self.MAX_PAGES:
+            self._pages.popitem(last=False)
+    
+    def _page(self, page_no):
+        if page_no in self._pages:
+            self._pages.move_to_end(page_no)
+            return self._pages[page_no]
+        
+        rows = self._query(page_no * self.PAGE_SIZE, self.PAGE_SIZE)
+        self._store_page(page_no, rows)
+        return rows
+    
+    def _request_page(self, page_no):
+        # Вытесненная страница для отрисовки: перечитывается в фоне,
+        # до прихода строки показываются пустыми
+        if page_no in self._pending_pages:
+            return
+        self._pending_pages.add(page_no)
+        generation = self._generation
+        sql, params = self._page_query(page_no * self.PAGE_SIZE, self.PAGE_SIZE)
+        self.executor.submit(
+            sql, params,
+            on_result=lambda rows: self._on_page_loaded(generation, page_no, rows),
+            on_error=lambda error: self._on_failed(generation, error))
+    
+    def _on_page_loaded(self, generation, page_no, rows):
+        if generation != self._generation:
+            return
+        self._pending_pages.discard(page_no)
+        self._store_page(page_no, rows)
+        first = page_no * self.PAGE_SIZE
+        last = min(first + self.PAGE_SIZE, self._row_count) - 1
+        if last >= first:
+            self.dataChanged.emit(self.index(first, 0), self.index(last, len(self.columns) - 1))
+    
+    def _on_failed(self, generation, error):
+        if generation != self._generation:
+            return
+        self._fetching = False
+        self._pending_pages.clear()
+        self.failed.emit(str(error))
+    
+    def refresh(self, first_page=None):
+        # first_page - уже прочитанная в фоне первая страница (LIMIT PAGE_SIZE)
+        self.beginResetModel()
+        self._generation += 1
+        self._pages.clear()
+        self._pending_pages.clear()
+        self._row_count = 0
+        self._at_end = False
+        self._fetching = False
+        self.loaded = True
+        self.endResetModel()
+        
+        if first_page is None:
+            self.fetchMore(QModelIndex())
+        else:
+            self._append_rows(first_page)
+    
+    def refresh_rows(self, keys):
+        # Перечитывает только строки с указанными ключами среди страниц в памяти;
+        # остальные прочитаются свежими, когда до них дойдет прокрутка
+        keys = set(keys)
+        positions = [(page_no, offset, rows[offset][0])
+                     for page_no, rows in self._pages.items()
+                     for offset in range(len(rows)) if rows[offset][0] in keys]
+        if not positions:
+            return
+        
+        found = list({key for _, _, key in positions})
+        if self.executor is None:
+            self._apply_rows(self._generation, self._read_rows(self.db.connection(), found))
+            return
+        
+        generation = self._generation
+        self.executor.submit(
+            fn=lambda conn, job: self._read_rows(conn, found),
+            on_result=lambda fresh: self._apply_rows(generation, fresh),
+            on_error=lambda error: self._on_failed(generation, error))
+    
+    def insert_rows(self, keys):
+        # Вставляет новые строки на их место в текущей сортировке, не перечитывая
+        # загруженные страницы. Строки за пределами загруженного диапазона
+        # прочитаются сами при прокрутке
+        keys = list(keys)
+        if not self.loaded or not keys:
+            return
+        
+        if self.executor is None:
+            self._apply_inserted(self._generation, self._read_inserted(self.db.connection(), keys))
+            return
+        
+        generation = self._generation
+        self.executor.submit(
+            fn=lambda conn, job: self._read_inserted(conn, keys),
+            on_result=lambda rows: self._apply_inserted(generation, rows),
+            on_error=lambda error: self._on_failed(generation, error))
+    
+    def _read_inserted(self, conn, keys):
+        # [(позиция, строка)] новых строк, прошедших текущий фильтр, по возрастанию позиции.
+        # Позиция - число строк, стоящих раньше в порядке ORDER BY модели
+        columns = ", ".join(expression for _, expression in self.columns)
+        where = f"({self._where}) AND " if self._where else ""
+        expression = self.columns[self.sort_column][1]
+        if self.sort_order == Qt.DescendingOrder:
+            before = (f"({expression} > ? OR ({expression} IS NOT NULL AND ? IS NULL)"
+                      f" OR ({expression} IS ? AND {self.key} > ?))")
+        else:
+            before = (f"({expression} < ? OR ({expression} IS NULL AND ? IS NOT NULL)"
+                      f" OR ({expression} IS ? AND {self.key} < ?))")
+        
+        cursor = conn.cursor()
+        inserted = []
+        for key in keys:
+            cursor.execute(f"SELECT {columns} FROM {self.source} WHERE {where}{self.key} = ?",
+                           (*self._params, key))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            value = row[self.sort_column]
+            cursor.execute(f"SELECT COUNT(*) FROM {self.source} WHERE {where}{before}",
+                           (*self._params, value, value, value, key))
+            inserted.append((cursor.fetchone()[0], row))
+        return sorted(inserted, key=lambda item: item[0])
+    
+    def _apply_inserted(self, generation, inserted):
+        if generation != self._generation:
+            return
+        if self._fetching or self._pending_pages:
+            # Параллельно читается страница, ее смещение могло уже учесть новые строки
+            self.refresh()
+            return
+        
+        for position, row in inserted:
+            self._insert_row(position, row)
+    
+    def _insert_row(self, position, row):
+        if position > self._row_count or (position == self._row_count and not self._at_end):
+            return
+        
+        # Строка сдвигает хвост загруженных страниц на одну позицию
+        self.beginInsertRows(QModelIndex(), position, position)
+        page_no, offset = divmod(position, self.PAGE_SIZE)
+        carry = row
+        while carry is not None:
+            rows = self._pages.get(page_no)
+            if rows is None:
+                # Содержимое вытесненной страницы неизвестно - следующие за ней перечитаются
+                for stale in [number for number in self._pages if number > page_no]:
+                    del self._pages[stale]
+                break
+            rows.insert(offset, carry)
+            carry = rows.pop() if len(rows) > self.PAGE_SIZE else None
+            page_no, offset = page_no + 1, 0
+        self._row_count += 1
+        self.endInsertRows()
+        
+        if not self._at_end:
+            # Пока конец не достигнут, загружено ровно кратно PAGE_SIZE строк:
+            # последняя строка уходит в еще не прочитанную страницу
+            self.beginRemoveRows(QModelIndex(), self._row_count - 1, self._row_count - 1)
+            self._pages.pop(self._row_count // self.PAGE_SIZE, None)
+            self._row_count -= 1
+            self.endRemoveRows()
+    
+    def _read_rows(self, conn, keys):
+        columns = ", ".join(expression for _, expression in self.columns)
+        fresh = {}
+        cursor = conn.cursor()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            cursor.execute(f"SELECT {columns} FROM {self.source} WHERE {self.key} IN "
+                           f"({', '.join('?' * len(chunk))})", chunk)
+            fresh.update((row[0], row) for row in cursor.fetchall())
+        return fresh
+    
+    def _apply_rows(self, generation, fresh):
+        # Позиции ищутся заново: пока строки читались, страницы могли смениться
+        if generation != self._generation:
+            return
+        for page_no, rows in self._pages.items():
+            for offset, row in enumerate(rows):
+                if row[0] in fresh:
+                    rows[offset] = fresh[row[0]]
+                    row_no = page_no * self.PAGE_SIZE + offset
+                    self.dataChanged.emit(self.index(row_no, 0),
+                                          self.index(row_no, len(self.columns) - 1))
+    
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+    
+    def set_filter(self, where="", params=(), first_page=None):
+        self._where = where
+        self._params = tuple(params)
+        self.refresh(first_page)
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._row_count
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self._at_end and not self._fetching
+    
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        
+        if self.executor is None:
+            self._append_rows(self._query(self._row_count, self.PAGE_SIZE))
+            return
+        
+        # Следующая страница запрашивается только после прихода предыдущей
+        self._fetching = True
+        generation = self._generation
+        sql, params = self._page_query(self._row_count, self.PAGE_SIZE)
+        self.executor.submit(
+            sql, params,
+            on_result=lambda rows: self._on_rows_fetched(generation, rows),
+            on_error=lambda error: self._on_failed(generation, error))
+    
+    def _on_rows_fetched(self, generation, rows):
+        if generation != self._generation:
+            return
+        self._fetching = False
+        self._append_rows(rows)
+    
+    def _append_rows(self, rows):
+        # Строк всегда кратно PAGE_SIZE, пока не достигнут конец выборки
+        if len(rows) < self.PAGE_SIZE:
+            self._at_end = True
+        if not rows:
+            return
+        
+        self.beginInsertRows(QModelIndex(), self._row_count, self._row_count + len(rows) - 1)
+        self._store_page(self._row_count // self.PAGE_SIZE, rows)
+        self._row_count += len(rows)
+        self.endInsertRows()
+    
+    def row(self, row):
+        if not 0 <= row < self._row_count:
+            return None
+        rows = self._page(row // self.PAGE_SIZE)
+        offset = row % self.PAGE_SIZE
+        return rows[offset] if offset < len(rows) else None
+    
+    def row_id(self, row):
+        data = self.row(row)
+        return data[0] if data else None
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        
+        row = index.row()
+        page_no = row // self.PAGE_SIZE
+        if self.executor is not None and page_no not in self._pages:
+            self._request_page(page_no)
+            return None
+        
+        data = self.row(row)
+        if data is None:
+            return None
+        value = data[index.column()]
+        return str(value) if value is not None else ""
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.columns[section][0]
+        return super().headerData(section, orientation, role)
+    
+    def sort(self, column, order=Qt.AscendingOrder):
+        # Сортировка выполняется в SQL, а не в памяти
+        self.sort_column = column
+        self.sort_order = order
+        if self.loaded:
+            self.refresh()
+
+class ProductsTableModel(SqlTableModel):
+    def __init__(self, db, executor=None, parent=None):
+        source, columns, key, sort_column, _ = TABLE_VIEWS["products"]
+        super().__init__(db, source, columns, key, sort_column, executor=executor, parent=parent)
+    
+    def search_filter(self, text):
+        return product_search_filter(text, self.db.has_fts)
+
+class ListTableModel(QAbstractTableModel):
+    # Таблица только для чтения поверх готового списка строк,
+    # без отдельного объекта на каждую ячейку как в QTableWidget
+    def __init__(self, headers, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        self.rows = []
+    
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self.rows = rows
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        value = self.rows[index.row()][index.column()]
+        return str(value) if value is not None else ""
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+class QueryJobSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    progress = pyqtSignal(int)
+    done = pyqtSignal()
+
+class QueryJob(QRunnable):
+    # SELECT (или функция fn(conn, job)) в пуле потоков на соединении из пула Database.
+    # cancel() прерывает уже выполняющийся запрос через sqlite3 interrupt(),
+    # а обработчик прогресса SQLite не дает начать следующий шаг после отмены
+    FETCH_SIZE = 5000
+    PROGRESS_STEP = 10000  # инструкций виртуальной машины SQLite между проверками
+    
+    def __init__(self, db, sql=None, params=(), fn=None):
+        super().__init__()
+        self.db = db
+        self.sql = sql
+        self.params = params
+        self.fn = fn
+        self.signals = QueryJobSignals()
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._conn = None
+    
+    def run(self):
+        try:
+            result = self._run()
+            if not self.cancelled:
+                self.signals.finished.emit(result)
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.failed.emit(e)
+        finally:
+            self.signals.done.emit()
+    
+    def _run(self):
+        with self.db.pooled() as conn:
+            with self._lock:
+                if self.cancelled:
+                    return None
+                self._conn = conn
+            conn.set_progress_handler(lambda: 1 if self.cancelled else 0, self.PROGRESS_STEP)
+            try:
+                return self.execute(conn)
+            finally:
+                conn.set_progress_handler(None, 0)
+                with self._lock:
+                    self._conn = None
+    
+    def execute(self, conn):
+        if self.fn is not None:
+            return self.fn(conn, self)
+        return conn.execute(self.sql, self.params).fetchall()
+    
+    def fetch_all(self, cursor):
+        # Читает выборку порциями и сообщает, сколько строк уже прочитано
+        rows = []
+        while not self.cancelled:
+            chunk = cursor.fetchmany(self.FETCH_SIZE)
+            if not chunk:
+                break
+            rows.extend(chunk)
+            self.report_progress(len(rows))
+        return rows
+    
+    def report_progress(self, value):
+        if not self.cancelled:
+            self.signals.progress.emit(value)
+    
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.interrupt()
+
+class QueryExecutor(QObject):
+    # Выполняет запросы вне потока GUI. Потоков столько же, сколько соединений
+    # в пуле Database, так что каждое задание сразу получает свое соединение.
+    # Результат, ошибка и прогресс приходят сигналами в поток GUI
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(db.pool_size)
+        self.jobs = set()
+    
+    def submit(self, sql=None, params=(), fn=None,
+               on_result=None, on_error=None, on_progress=None):
+        job = QueryJob(self.db, sql, params, fn)
+        for signal, callback in ((job.signals.finished, on_result),
+                                 (job.signals.failed, on_error),
+                                 (job.signals.progress, on_progress)):
+            if callback is not None:
+                signal.connect(lambda value, callback=callback: self._deliver(job, callback, value))
+        job.signals.done.connect(lambda: self.jobs.discard(job))
+        
+        self.jobs.add(job)
+        self.pool.start(job)
+        return job
+    
+    def _deliver(self, job, callback, value):
+        # Сигнал мог встать в очередь еще до отмены - после отмены ответы не доставляются
+        if not job.cancelled:
+            callback(value)
+    
+    def cancel_all(self):
+        for job in list(self.jobs):
+            job.cancel()
+    
+    def wait(self):
+        self.pool.waitForDone()
+
+class ReservationSweeper(QObject):
+    # Периодически закрывает просроченные резервы в фоновом потоке
+    # и дописывает снимки остатков за завершившиеся месяцы. Таблицы узнают
+    # о закрытых резервах через Database.subscribe, как после проведения документов
+    INTERVAL = 5 * 60 * 1000  # мс
+    
+    def __init__(self, service, executor, parent=None):
+        super().__init__(parent)
+        self.service = service
+        self.executor = executor
+        self.job = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.INTERVAL)
+        self.timer.timeout.connect(self.sweep)
+    
+    def start(self):
+        self.timer.start()
+        self.sweep()
+    
+    def stop(self):
+        self.timer.stop()
+    
+    def sweep(self):
+        if self.job is not None:
+            return
+        
+        self.job = self.executor.submit(
+            fn=self.run_sweep, on_result=self.on_finished, on_error=self.on_failed)
+    
+    def run_sweep(self, conn, job):
+        self.service.checkpoint_stock(conn=conn)
+        return self.service.expire_reservations(conn=conn)
+    
+    def on_finished(self, result):
+        self.job = None
+    
+    def on_failed(self, error):
+        self.job = None
+        logger.warning("Помилка при закритті прострочених резервів: %s", error)
+
+# Настройки детектора зависаний, переопределяются переменными WAREHOUSE_<КЛЮЧ>
+WATCHDOG_SETTINGS = {
+    "stall_ms": 500,                    # задержка цикла событий, считающаяся зависанием, 0 - отключить
+    "stall_log": "stalls.log",          # журнал для отправки в поддержку
+    "stall_log_bytes": 1024 * 1024,
+    "stall_log_backups": 5,
+}
+
+class StallWatchdog(QObject):
+    # Детектор зависаний GUI. Таймер в потоке GUI отмечает пульс, вспомогательный
+    # поток смотрит, как давно пульса не было, и пока цикл событий стоит, снимает
+    # стек главного потока. Когда пульс возвращается, зависание записывается
+    # с самым частым стеком и методом load_*/generate_*/save_*, в котором оно было
+    HEARTBEAT_MS = 100
+    CHECK_MS = 50
+    MAX_SAMPLES = 50
+    ATTRIBUTED = re.compile(r"(load|generate|save)_")
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.settings = {**WATCHDOG_SETTINGS, **db_settings_from_env(WATCHDOG_SETTINGS)}
+        self.stall_ms = self.settings["stall_ms"]
+        self.stalls = deque(maxlen=100)
+        self.max_lag_ms = 0.0
+        self._main_ident = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._samples = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        
+        self.log = file_logger("warehouse.stalls",
+                               self.settings["stall_log"] if self.stall_ms > 0 else "",
+                               self.settings["stall_log_bytes"], self.settings["stall_log_backups"])
+        
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.HEARTBEAT_MS)
+        self.timer.timeout.connect(self.beat)
+    
+    def start(self):
+        if self.stall_ms <= 0:
+            return
+        self._last_beat = time.monotonic()
+        self.timer.start()
+        self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self.timer.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def beat(self):
+        now = time.monotonic()
+        lag = (now - self._last_beat) * 1000 - self.HEARTBEAT_MS
+        self._last_beat = now
+        self.max_lag_ms = max(self.max_lag_ms, lag)
+        if lag >= self.stall_ms:
+            with self._lock:
+                samples, self._samples = self._samples, []
+            self.report(lag, samples)
+    
+    def _watch(self):
+        while not self._stop.wait(self.CHECK_MS / 1000):
+            lag = (time.monotonic() - self._last_beat) * 1000 - self.HEARTBEAT_MS
+            if lag < self.stall_ms:
+                continue
+            # Для долгих зависаний - первые MAX_SAMPLES снимков
+            with self._lock:
+                if len(self._samples) < self.MAX_SAMPLES:
+                    self._samples.append(self._sample())
+    
+    def _sample(self):
+        frame = sys._current_frames().get(self._main_ident)
+        if frame is None:
+            return None, ""
+        method = None
+        current = frame
+        while current is not None:
+            code = current.f_code
+            if self.ATTRIBUTED.match(code.co_name):
+                method = getattr(code, "co_qualname", code.co_name)
+                break
+            current = current.f_back
+        return method, "".join(traceback.format_stack(frame))
+    
+    def report(self, lag, samples):
+        methods = Counter(method for method, _ in samples if method)
+        stacks = Counter(stack for _, stack in samples if stack)
+        method = methods.most_common(1)[0][0] if methods else None
+        stack = stacks.most_common(1)[0][0] if stacks else ""
+        entry = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "ms": round(lag),
+            "method": method or "",
+            "samples": len(samples),
+            "stack": stack,
+        }
+        self.stalls.append(entry)
+        self.log.warning("Зависання %d мс у %s (знімків стеку: %d)\n%s", entry["ms"],
+                         entry["method"] or "невідомо", entry["samples"], stack or "  стек не знято\n")
+
+class SqlTableView(QTableView):
+    # Таблица для SqlTableModel: выбор строками, сортировка по клику в SQL
+    def __init__(self, model, stretch_column=None, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        
+        header = self.horizontalHeader()
+        if stretch_column is not None:
+            header.setSectionResizeMode(stretch_column, QHeaderView.Stretch)
+        header.setSortIndicator(model.sort_column, model.sort_order)
+        self.setSortingEnabled(True)
+    
+    def current_row(self):
+        # Данные выделенной строки или None
+        row = self.currentIndex().row()
+        return self.model().row(row) if row != -1 else None
+
+class DiagnosticsDialog(QDialog):
+    # Статистика запросов Database.stats: суммарное время по тексту запроса
+    # и журнал медленных запросов с планом выполнения; зависания окна - из StallWatchdog
+    def __init__(self, db, watchdog=None, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.watchdog = watchdog
+        self.slow = []
+        self.stalls = []
+        self.setup_ui()
+        self.refresh()
+        
+    def setup_ui(self):
+        self.setWindowTitle("Діагностика запитів")
+        self.resize(1000, 700)
+        
+        layout = QVBoxLayout()
+        self.summary_label = QLabel()
+        layout.addWidget(self.summary_label)
+        
+        self.tabs = QTabWidget()
+        self.statements_table = QTableWidget()
+        self.statements_table.setColumnCount(6)
+        self.statements_table.setHorizontalHeaderLabels(
+            ["Запит", "Викликів", "Всього, мс", "Середнє, мс", "Макс., мс", "Рядків"])
+        self.statements_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.statements_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.tabs.addTab(self.statements_table, "Запити")
+        
+        slow_widget = QWidget()
+        slow_layout = QVBoxLayout()
+        self.slow_table = QTableWidget()
+        self.slow_table.setColumnCount(5)
+        self.slow_table.setHorizontalHeaderLabels(["Час", "мс", "Рядків", "Потік", "Запит"])
+        self.slow_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.slow_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.slow_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.plan_text = QTextEdit()
+        self.plan_text.setReadOnly(True)
+        slow_layout.addWidget(self.slow_table, 2)
+        slow_layout.addWidget(self.plan_text, 1)
+        slow_widget.setLayout(slow_layout)
+        self.tabs.addTab(slow_widget, "Повільні")
+        
+        stalls_widget = QWidget()
+        stalls_layout = QVBoxLayout()
+        self.stalls_table = QTableWidget()
+        self.stalls_table.setColumnCount(4)
+        self.stalls_table.setHorizontalHeaderLabels(["Час", "мс", "Метод", "Знімків"])
+        self.stalls_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.stalls_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.stalls_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.stack_text = QTextEdit()
+        self.stack_text.setReadOnly(True)
+        stalls_layout.addWidget(self.stalls_table, 2)
+        stalls_layout.addWidget(self.stack_text, 1)
+        stalls_widget.setLayout(stalls_layout)
+        self.tabs.addTab(stalls_widget, "Зависання")
+        layout.addWidget(self.tabs)
+        
+        button_layout = QHBoxLayout()
+        self.refresh_btn = QPushButton("🔄 Оновити")
+        self.reset_btn = QPushButton("Скинути")
+        self.save_btn = QPushButton("Зберегти JSON...")
+        self.close_btn = QPushButton("Закрити")
+        button_layout.addWidget(self.refresh_btn)
+        button_layout.addWidget(self.reset_btn)
+        button_layout.addWidget(self.save_btn)
+        button_layout.addStretch()
+        button_layout.addWidget(self.close_btn)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+        
+        enabled = self.db.stats is not None
+        self.reset_btn.setEnabled(enabled)
+        self.save_btn.setEnabled(enabled)
+        
+        self.refresh_btn.clicked.connect(self.refresh)
+        self.reset_btn.clicked.connect(self.reset)
+        self.save_btn.clicked.connect(self.save_json)
+        self.close_btn.clicked.connect(self.accept)
+        self.slow_table.currentCellChanged.connect(self.show_plan)
+        self.stalls_table.currentCellChanged.connect(self.show_stack)
+    
+    def refresh(self):
+        self.refresh_stalls()
+        if self.db.stats is None:
+            self.summary_label.setText("Профілювання запитів вимкнено (WAREHOUSE_QUERY_PROFILE=0)")
+            return
+        
+        snapshot = self.db.stats.snapshot()
+        statements = snapshot["statements"]
+        self.summary_label.setText(
+            f"З {snapshot['since']}: запитів {len(statements)}, "
+            f"викликів {sum(s['calls'] for s in statements)}, "
+            f"всього {sum(s['total_ms'] for s in statements) / 1000:.1f} с. "
+            f"Поріг повільних запитів {snapshot['slow_query_ms']} мс")
+        
+        self.statements_table.setRowCount(len(statements))
+        for row, statement in enumerate(statements):
+            values = [statement["sql"], statement["calls"], f"{statement['total_ms']:.1f}",
+                      f"{statement['avg_ms']:.2f}", f"{statement['max_ms']:.1f}", statement["rows"]]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if column == 0:
+                    item.setToolTip(statement["sql"])
+                self.statements_table.setItem(row, column, item)
+        
+        # Свежие медленные запросы сверху
+        self.slow = list(reversed(snapshot["slow"]))
+        self.slow_table.setRowCount(len(self.slow))
+        for row, entry in enumerate(self.slow):
+            values = [entry["time"], entry["ms"], entry["rows"], entry["thread"], entry["sql"]]
+            for column, value in enumerate(values):
+                self.slow_table.setItem(row, column, QTableWidgetItem(str(value)))
+        self.plan_text.clear()
+    
+    def refresh_stalls(self):
+        if self.watchdog is None or self.watchdog.stall_ms <= 0:
+            self.stalls_table.setRowCount(0)
+            self.stack_text.setPlainText("Детектор зависань вимкнено (WAREHOUSE_STALL_MS=0)")
+            return
+        
+        self.stalls = list(reversed(self.watchdog.stalls))
+        self.stalls_table.setRowCount(len(self.stalls))
+        for row, entry in enumerate(self.stalls):
+            values = [entry["time"], entry["ms"], entry["method"], entry["samples"]]
+            for column, value in enumerate(values):
+                self.stalls_table.setItem(row, column, QTableWidgetItem(str(value)))
+        self.stack_text.setPlainText(
+            f"Поріг {self.watchdog.stall_ms} мс, найбільша затримка {self.watchdog.max_lag_ms:.0f} мс. "
+            f"Журнал: {self.watchdog.settings['stall_log']}")
+    
+    def show_stack(self, row, column, previous_row, previous_column):
+        if not 0 <= row < len(self.stalls):
+            return
+        entry = self.stalls[row]
+        self.stack_text.setPlainText(f"{entry['method'] or 'Метод не визначено'}\n\n{entry['stack']}")
+    
+    def show_plan(self, row, column, previous_row, previous_column):
+        if not 0 <= row < len(self.slow):
+            return
+        entry = self.slow[row]
+        self.plan_text.setPlainText(
+            f"{entry['sql']}\n\nПараметри: {entry['params']}\n\n"
+            f"EXPLAIN QUERY PLAN:\n" + "\n".join(entry["plan"]))
+    
+    def reset(self):
+        self.db.stats.reset()
+        self.refresh()
+    
+    def save_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Зберегти статистику", "query_stats.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            self.db.stats.dump(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Помилка", f"Не вдалося зберегти файл: {str(e)}")
+
 class MainWindow(QMainWindow):
+    # Изменения данных из Database, доставляются в поток GUI
+    data_changed = pyqtSignal(object)
+    
     def __init__(self):
         super().__init__()
         self.db = Database()
+        self.service = WarehouseService(self.db)
+        # Все чтения таблиц и отчетов идут через фоновый исполнитель
+        self.executor = QueryExecutor(self.db, self)
+        self.report_cache = ReportCache()
+        self.catalog = ProductCatalogModel(self.db, self)
         self.setup_ui()
         self.load_products()
         
+        # Детектор зависаний окна пишет stalls.log для поддержки
+        self.watchdog = StallWatchdog(self)
+        self.watchdog.start()
+        
+        # Фоновое закрытие просроченных резервов
+        self.sweeper = ReservationSweeper(self.service, self.executor, self)
+        self.sweeper.start()
+        
+        # Проведение документов обновляет только затронутые строки таблиц
+        self.data_changed.connect(self.on_data_changed)
+        self.db.subscribe(self.data_changed.emit)
+        
     def setup_ui(self):
         self.setWindowTitle("СкладУчет v1.0 - Продажі та Звіти")
         self.setGeometry(100, 100, 1200, 800)
@@ -1190,16 +2021,23 @@ class MainWindow(QMainWindow):
         
         layout.addWidget(self.tabs)
         
+        # Вкладки читают первую страницу только при первом открытии
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+        
         # Панель быстрого доступа
         quick_access_layout = QHBoxLayout()
         self.reports_btn = QPushButton("📊 Звіти")
         self.quick_sale_btn = QPushButton("🛒 Швидка накладна")
         self.quick_reserve_btn = QPushButton("⏰ Швидке резервування")
+        self.export_btn = QPushButton("📤 Експорт")
+        self.diagnostics_btn = QPushButton("🩺 Діагностика")
         
         quick_access_layout.addWidget(self.reports_btn)
         quick_access_layout.addWidget(self.quick_sale_btn)
         quick_access_layout.addWidget(self.quick_reserve_btn)
+        quick_access_layout.addWidget(self.export_btn)
         quick_access_layout.addStretch()
+        quick_access_layout.addWidget(self.diagnostics_btn)
         
         layout.addLayout(quick_access_layout)
         central_widget.setLayout(layout)
@@ -1208,6 +2046,8 @@ class MainWindow(QMainWindow):
         self.reports_btn.clicked.connect(self.show_reports)
         self.quick_sale_btn.clicked.connect(self.quick_sale)
         self.quick_reserve_btn.clicked.connect(self.quick_reserve)
+        self.export_btn.clicked.connect(self.export_current_tab)
+        self.diagnostics_btn.clicked.connect(self.show_diagnostics)
     
     def setup_products_tab(self):
         layout = QVBoxLayout()
@@ -1219,32 +2059,35 @@ class MainWindow(QMainWindow):
         self.edit_btn = QPushButton("✏️ Редагувати")
         self.delete_btn = QPushButton("🗑️ Видалити")
         self.refresh_btn = QPushButton("🔄 Оновити")
+        self.import_btn = QPushButton("📥 Імпорт")
         
         button_layout.addWidget(self.add_btn)
         button_layout.addWidget(self.edit_btn)
         button_layout.addWidget(self.delete_btn)
         button_layout.addWidget(self.refresh_btn)
+        button_layout.addWidget(self.import_btn)
         button_layout.addStretch()
         
         # Поиск
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Пошук по назві або артикулу...")
         
+        # Поиск запускается после паузы в наборе, а не на каждую клавишу
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.search_products)
+        self.search_job = None
+        
         button_layout.addWidget(QLabel("Пошук:"))
         button_layout.addWidget(self.search_input)
         
         layout.addLayout(button_layout)
         
         # Таблица
-        self.table = QTableWidget()
-        self.table.setColumnCount(7)
-        self.table.setHorizontalHeaderLabels([
-            "ID", "Артикул", "Назва", "Ціна вх.", "Ціна роздр.", "Категорія", "Залишок"
-        ])
-        
-        # Настройка таблицы
-        header = self.table.horizontalHeader()
-        header.setSectionResizeMode(2, QHeaderView.Stretch)
+        self.products_model = ProductsTableModel(self.db, self.executor, self)
+        self.products_model.failed.connect(self.on_load_failed)
+        self.table = SqlTableView(self.products_model, stretch_column=2)
         
         layout.addWidget(self.table)
         
@@ -1255,7 +2098,8 @@ class MainWindow(QMainWindow):
         self.edit_btn.clicked.connect(self.edit_product)
         self.delete_btn.clicked.connect(self.delete_product)
         self.refresh_btn.clicked.connect(self.load_products)
-        self.search_input.textChanged.connect(self.search_products)
+        self.import_btn.clicked.connect(self.import_products)
+        self.search_input.textChanged.connect(self.search_timer.start)
     
     def setup_suppliers_tab(self):
         layout = QVBoxLayout()
@@ -1277,14 +2121,9 @@ class MainWindow(QMainWindow):
         layout.addLayout(button_layout)
         
         # Таблица поставщиков
-        self.suppliers_table = QTableWidget()
-        self.suppliers_table.setColumnCount(5)
-        self.suppliers_table.setHorizontalHeaderLabels([
-            "ID", "Назва", "Контакт", "Телефон", "Email"
-        ])
-        
-        header = self.suppliers_table.horizontalHeader()
-        header.setSectionResizeMode(1, QHeaderView.Stretch)
+        self.suppliers_model = SqlTableModel.from_view(self.db, "suppliers", self.executor, self)
+        self.suppliers_model.failed.connect(self.on_load_failed)
+        self.suppliers_table = SqlTableView(self.suppliers_model, stretch_column=1)
         
         layout.addWidget(self.suppliers_table)
         
@@ -1312,14 +2151,9 @@ class MainWindow(QMainWindow):
         layout.addLayout(button_layout)
         
         # Таблица надходжений
-        self.receipts_table = QTableWidget()
-        self.receipts_table.setColumnCount(5)
-        self.receipts_table.setHorizontalHeaderLabels([
-            "ID", "Номер", "Дата", "Постачальник", "Сума"
-        ])
-        
-        header = self.receipts_table.horizontalHeader()
-        header.setSectionResizeMode(3, QHeaderView.Stretch)
+        self.receipts_model = SqlTableModel.from_view(self.db, "receipts", self.executor, self)
+        self.receipts_model.failed.connect(self.on_load_failed)
+        self.receipts_table = SqlTableView(self.receipts_model, stretch_column=3)
         
         layout.addWidget(self.receipts_table)
         
@@ -1345,14 +2179,10 @@ class MainWindow(QMainWindow):
         layout.addLayout(button_layout)
         
         # Таблица продаж
-        self.sales_table = QTableWidget()
-        self.sales_table.setColumnCount(6)
-        self.sales_table.setHorizontalHeaderLabels([
-            "ID", "Номер", "Дата", "Клієнт", "Позицій", "Сума"
-        ])
-        
-        header = self.sales_table.horizontalHeader()
-        header.setSectionResizeMode(3, QHeaderView.Stretch)
+        # Позиции считаются только для загруженной страницы (покрывающий индекс)
+        self.sales_model = SqlTableModel.from_view(self.db, "sales", self.executor, self)
+        self.sales_model.failed.connect(self.on_load_failed)
+        self.sales_table = SqlTableView(self.sales_model, stretch_column=3)
         
         layout.addWidget(self.sales_table)
         
@@ -1382,14 +2212,9 @@ class MainWindow(QMainWindow):
         layout.addLayout(button_layout)
         
         # Таблица резервов
-        self.reservations_table = QTableWidget()
-        self.reservations_table.setColumnCount(7)
-        self.reservations_table.setHorizontalHeaderLabels([
-            "ID", "Клієнт", "Товар", "Кількість", "Дата резерву", "Дійсний до", "Статус"
-        ])
-        
-        header = self.reservations_table.horizontalHeader()
-        header.setSectionResizeMode(1, QHeaderView.Stretch)
+        self.reservations_model = SqlTableModel.from_view(self.db, "reservations", self.executor, self)
+        self.reservations_model.failed.connect(self.on_load_failed)
+        self.reservations_table = SqlTableView(self.reservations_model, stretch_column=1)
         
         layout.addWidget(self.reservations_table)
         
@@ -1401,129 +2226,54 @@ class MainWindow(QMainWindow):
         self.reserve_cancel_btn.clicked.connect(self.cancel_reservation)
         self.reserve_refresh_btn.clicked.connect(self.load_reservations)
     
+    def on_tab_changed(self, index):
+        table = self.tabs.widget(index).findChild(SqlTableView)
+        if table is not None:
+            table.model().ensure_loaded()
+    
     def load_products(self):
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM products ORDER BY name")
-        products = cursor.fetchall()
-        conn.close()
-        
-        self.table.setRowCount(len(products))
-        
-        for row, product in enumerate(products):
-            for col, value in enumerate(product[:7]):  # Показываем первые 7 полей
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                if col > 0:  # Не редактируем ID
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row, col, item)
+        self.products_model.refresh()
     
     def load_suppliers(self):
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM suppliers ORDER BY name")
-        suppliers = cursor.fetchall()
-        conn.close()
-        
-        self.suppliers_table.setRowCount(len(suppliers))
-        
-        for row, supplier in enumerate(suppliers):
-            for col, value in enumerate(supplier[:5]):  # Показываем первые 5 полей
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                if col > 0:
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.suppliers_table.setItem(row, col, item)
+        self.suppliers_model.refresh()
     
     def load_receipts(self):
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.id, r.document_number, r.receipt_date, s.name, r.total_amount
-            FROM receipts r
-            LEFT JOIN suppliers s ON r.supplier_id = s.id
-            ORDER BY r.receipt_date DESC
-        ''')
-        receipts = cursor.fetchall()
-        conn.close()
-        
-        self.receipts_table.setRowCount(len(receipts))
-        
-        for row, receipt in enumerate(receipts):
-            for col, value in enumerate(receipt):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.receipts_table.setItem(row, col, item)
+        self.receipts_model.refresh()
     
     def load_sales(self):
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT s.id, s.document_number, s.sale_date, s.client_name,
-                   (SELECT COUNT(*) FROM sale_items WHERE sale_id = s.id) as items_count,
-                   s.total_amount
-            FROM sales s
-            ORDER BY s.sale_date DESC
-        ''')
-        sales = cursor.fetchall()
-        conn.close()
-        
-        self.sales_table.setRowCount(len(sales))
-        
-        for row, sale in enumerate(sales):
-            for col, value in enumerate(sale):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.sales_table.setItem(row, col, item)
+        self.sales_model.refresh()
     
     def load_reservations(self):
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.id, r.client_name, p.name, r.quantity, 
-                   r.reservation_date, r.expiry_date, r.status
-            FROM reservations r
-            JOIN products p ON r.product_id = p.id
-            ORDER BY r.reservation_date DESC
-        ''')
-        reservations = cursor.fetchall()
-        conn.close()
-        
-        self.reservations_table.setRowCount(len(reservations))
-        
-        for row, reservation in enumerate(reservations):
-            for col, value in enumerate(reservation):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.reservations_table.setItem(row, col, item)
+        self.reservations_model.refresh()
+    
+    def on_load_failed(self, error):
+        QMessageBox.warning(self, "Помилка", f"Помилка завантаження даних: {error}")
     
     def search_products(self):
-        search_text = self.search_input.text().strip()
-        conn = sqlite3.connect(self.db.db_name)
-        cursor = conn.cursor()
-        
-        if search_text:
-            cursor.execute('''
-                SELECT * FROM products 
-                WHERE name LIKE ? OR article LIKE ?
-                ORDER BY name
-            ''', (f'%{search_text}%', f'%{search_text}%'))
-        else:
-            cursor.execute("SELECT * FROM products ORDER BY name")
-            
-        products = cursor.fetchall()
-        conn.close()
-        
-        self.table.setRowCount(len(products))
-        for row, product in enumerate(products):
-            for col, value in enumerate(product[:7]):
-                item = QTableWidgetItem(str(value) if value is not None else "")
-                if col > 0:
-                    item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.table.setItem(row, col, item)
+        # Новый запрос отменяет еще не завершенный предыдущий
+        if self.search_job is not None:
+            self.search_job.cancel()
+        
+        where, params = self.products_model.search_filter(self.search_input.text().strip())
+        sql, sql_params = self.products_model.query(where, params)
+        
+        job = self.executor.submit(
+            sql + " LIMIT ?", (*sql_params, self.products_model.PAGE_SIZE),
+            on_result=lambda rows: self.on_search_finished(job, where, params, rows),
+            on_error=lambda error: QMessageBox.warning(self, "Помилка", f"Помилка пошуку: {error}"))
+        self.search_job = job
+    
+    def on_search_finished(self, job, where, params, rows):
+        # Результат устаревшего запроса отбрасываем
+        if job is not self.search_job:
+            return
+        self.search_job = None
+        self.products_model.set_filter(where, params, first_page=rows)
     
     def add_product(self):
         dialog = ProductDialog(self)
         if dialog.exec_() == QDialog.Accepted:
-            conn = sqlite3.connect(self.db.db_name)
+            conn = self.db.connection()
             cursor = conn.cursor()
             try:
                 cursor.execute('''
@@ -1532,30 +2282,27 @@ class MainWindow(QMainWindow):
                 ''', dialog.product_data)
                 conn.commit()
                 QMessageBox.information(self, "Успіх", "Товар успішно додано!")
+                self.catalog.invalidate()
                 self.load_products()
             except sqlite3.IntegrityError:
+                conn.rollback()
                 QMessageBox.warning(self, "Помилка", "Товар з таким артикулом вже існує!")
-            finally:
-                conn.close()
     
     def edit_product(self):
-        current_row = self.table.currentRow()
-        if current_row == -1:
+        product = self.table.current_row()
+        if product is None:
             QMessageBox.warning(self, "Помилка", "Виберіть товар для редагування!")
             return
             
-        product_id = int(self.table.item(current_row, 0).text())
+        product_id = product[0]
         
-        conn = sqlite3.connect(self.db.db_name)
+        conn = self.db.connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
         product_data = cursor.fetchone()
-        conn.close()
         
         dialog = ProductDialog(self, product_data)
         if dialog.exec_() == QDialog.Accepted:
-            conn = sqlite3.connect(self.db.db_name)
-            cursor = conn.cursor()
             try:
                 cursor.execute('''
                     UPDATE products 
@@ -1564,20 +2311,19 @@ class MainWindow(QMainWindow):
                 ''', (*dialog.product_data, product_id))
                 conn.commit()
                 QMessageBox.information(self, "Успіх", "Товар успішно оновлено!")
+                self.catalog.invalidate()
                 self.load_products()
             except sqlite3.IntegrityError:
+                conn.rollback()
                 QMessageBox.warning(self, "Помилка", "Товар з таким артикулом вже існує!")
-            finally:
-                conn.close()
     
     def delete_product(self):
-        current_row = self.table.currentRow()
-        if current_row == -1:
+        product = self.table.current_row()
+        if product is None:
             QMessageBox.warning(self, "Помилка", "Виберіть товар для видалення!")
             return
             
-        product_id = int(self.table.item(current_row, 0).text())
-        product_name = self.table.item(current_row, 2).text()
+        product_id, product_name = product[0], product[2]
         
         reply = QMessageBox.question(
             self, 
@@ -1587,19 +2333,58 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            conn = sqlite3.connect(self.db.db_name)
+            conn = self.db.connection()
             cursor = conn.cursor()
             cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
             conn.commit()
-            conn.close()
             
             QMessageBox.information(self, "Успіх", "Товар успішно видалено!")
+            self.catalog.invalidate()
             self.load_products()
     
+    def import_products(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Імпорт товарів", "", "Прайс (*.csv *.xlsx);;CSV (*.csv);;Excel (*.xlsx)")
+        if not path:
+            return
+        
+        progress = QProgressDialog("Імпорт товарів...", "Зупинити", 0, 0, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        
+        job = self.executor.submit(
+            fn=lambda conn, job: self.service.import_products(path, conn, job),
+            on_result=lambda result: self.on_import_finished(progress, *result),
+            on_error=lambda error: self.on_import_failed(progress, error),
+            on_progress=lambda count: progress.setLabelText(f"Імпорт товарів... записано {count}"))
+        progress.canceled.connect(job.cancel)
+        # Уже записанные пачки остаются и после остановки - перечитываем товары в любом случае
+        job.signals.done.connect(self.on_import_done)
+    
+    def on_import_finished(self, progress, imported, errors):
+        progress.reset()
+        message = QMessageBox(self)
+        message.setWindowTitle("Імпорт товарів")
+        message.setText(f"Записано товарів: {imported}\nРядків з помилками: {len(errors)}")
+        if errors:
+            lines = [f"Рядок {line_no}: {error}" for line_no, error in errors[:1000]]
+            if len(errors) > 1000:
+                lines.append(f"... і ще {len(errors) - 1000}")
+            message.setDetailedText("\n".join(lines))
+        message.exec_()
+    
+    def on_import_failed(self, progress, error):
+        progress.reset()
+        QMessageBox.warning(self, "Помилка", f"Помилка при імпорті: {error}")
+    
+    def on_import_done(self):
+        self.catalog.invalidate()
+        self.load_products()
+    
     def add_supplier(self):
         dialog = SupplierDialog(self)
         if dialog.exec_() == QDialog.Accepted:
-            conn = sqlite3.connect(self.db.db_name)
+            conn = self.db.connection()
             cursor = conn.cursor()
             try:
                 cursor.execute('''
@@ -1610,28 +2395,24 @@ class MainWindow(QMainWindow):
                 QMessageBox.information(self, "Успіх", "Постачальника успішно додано!")
                 self.load_suppliers()
             except Exception as e:
+                conn.rollback()
                 QMessageBox.warning(self, "Помилка", f"Помилка при додаванні: {str(e)}")
-            finally:
-                conn.close()
     
     def edit_supplier(self):
-        current_row = self.suppliers_table.currentRow()
-        if current_row == -1:
+        supplier = self.suppliers_table.current_row()
+        if supplier is None:
             QMessageBox.warning(self, "Помилка", "Виберіть постачальника для редагування!")
             return
             
-        supplier_id = int(self.suppliers_table.item(current_row, 0).text())
+        supplier_id = supplier[0]
         
-        conn = sqlite3.connect(self.db.db_name)
+        conn = self.db.connection()
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM suppliers WHERE id = ?", (supplier_id,))
         supplier_data = cursor.fetchone()
-        conn.close()
         
         dialog = SupplierDialog(self, supplier_data)
         if dialog.exec_() == QDialog.Accepted:
-            conn = sqlite3.connect(self.db.db_name)
-            cursor = conn.cursor()
             try:
                 cursor.execute('''
                     UPDATE suppliers 
@@ -1642,18 +2423,16 @@ class MainWindow(QMainWindow):
                 QMessageBox.information(self, "Успіх", "Постачальника успішно оновлено!")
                 self.load_suppliers()
             except Exception as e:
+                conn.rollback()
                 QMessageBox.warning(self, "Помилка", f"Помилка при оновленні: {str(e)}")
-            finally:
-                conn.close()
     
     def delete_supplier(self):
-        current_row = self.suppliers_table.currentRow()
-        if current_row == -1:
+        supplier = self.suppliers_table.current_row()
+        if supplier is None:
             QMessageBox.warning(self, "Помилка", "Виберіть постачальника для видалення!")
             return
             
-        supplier_id = int(self.suppliers_table.item(current_row, 0).text())
-        supplier_name = self.suppliers_table.item(current_row, 1).text()
+        supplier_id, supplier_name = supplier[0], supplier[1]
         
         reply = QMessageBox.question(
             self, 
@@ -1663,39 +2442,34 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            conn = sqlite3.connect(self.db.db_name)
+            conn = self.db.connection()
             cursor = conn.cursor()
             cursor.execute("DELETE FROM suppliers WHERE id = ?", (supplier_id,))
             conn.commit()
-            conn.close()
             
             QMessageBox.information(self, "Успіх", "Постачальника успішно видалено!")
             self.load_suppliers()
     
     def add_receipt(self):
-        dialog = ReceiptDialog(self)
-        if dialog.exec_() == QDialog.Accepted:
-            self.load_receipts()
-            self.load_products()  # Обновляем залишки
+        # Таблицы и остатки обновятся по уведомлению Database после проведения
+        dialog = ReceiptDialog(self.service, self.catalog, self)
+        dialog.exec_()
     
     def add_sale(self):
-        dialog = SaleDialog(self)
-        if dialog.exec_() == QDialog.Accepted:
-            self.load_sales()
-            self.load_products()  # Обновляем залишки
+        dialog = SaleDialog(self.service, self.catalog, self)
+        dialog.exec_()
     
     def add_reservation(self):
-        dialog = ReservationDialog(self)
-        if dialog.exec_() == QDialog.Accepted:
-            self.load_reservations()
+        dialog = ReservationDialog(self.service, self.catalog, self)
+        dialog.exec_()
     
     def complete_reservation(self):
-        current_row = self.reservations_table.currentRow()
-        if current_row == -1:
+        reservation = self.reservations_table.current_row()
+        if reservation is None:
             QMessageBox.warning(self, "Помилка", "Виберіть резерв для завершення!")
             return
         
-        reservation_id = int(self.reservations_table.item(current_row, 0).text())
+        reservation_id = reservation[0]
         
         reply = QMessageBox.question(
             self, 
@@ -1705,22 +2479,19 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            conn = sqlite3.connect(self.db.db_name)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE reservations SET status = 'completed' WHERE id = ?", (reservation_id,))
-            conn.commit()
-            conn.close()
+            if not self.service.complete_reservation(reservation_id):
+                QMessageBox.warning(self, "Помилка", "Резерв вже не активний!")
+                return
             
             QMessageBox.information(self, "Успіх", "Резерв успішно завершено!")
-            self.load_reservations()
     
     def cancel_reservation(self):
-        current_row = self.reservations_table.currentRow()
-        if current_row == -1:
+        reservation = self.reservations_table.current_row()
+        if reservation is None:
             QMessageBox.warning(self, "Помилка", "Виберіть резерв для скасування!")
             return
         
-        reservation_id = int(self.reservations_table.item(current_row, 0).text())
+        reservation_id = reservation[0]
         
         reply = QMessageBox.question(
             self, 
@@ -1730,19 +2501,50 @@ class MainWindow(QMainWindow):
         )
         
         if reply == QMessageBox.Yes:
-            conn = sqlite3.connect(self.db.db_name)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE reservations SET status = 'cancelled' WHERE id = ?", (reservation_id,))
-            conn.commit()
-            conn.close()
+            if not self.service.cancel_reservation(reservation_id):
+                QMessageBox.warning(self, "Помилка", "Резерв вже не активний!")
+                return
             
             QMessageBox.information(self, "Успіх", "Резерв успішно скасовано!")
-            self.load_reservations()
+    
+    def on_data_changed(self, changes):
+        # Новые строки встают на свое место, измененные перечитываются точечно;
+        # вкладки, которые еще не открывались, прочитаются при открытии
+        models = {
+            "products": self.products_model,
+            "suppliers": self.suppliers_model,
+            "receipts": self.receipts_model,
+            "sales": self.sales_model,
+            "reservations": self.reservations_model,
+        }
+        for table, rows in changes.items():
+            model = models.get(table)
+            if model is None:
+                continue
+            if rows["inserted"]:
+                model.insert_rows(rows["inserted"])
+            if rows["updated"]:
+                model.refresh_rows(rows["updated"])
+        
+        if "products" in changes:
+            self.catalog.update_stock(changes["products"]["updated"])
+    
+    def show_diagnostics(self):
+        dialog = DiagnosticsDialog(self.db, self.watchdog, self)
+        dialog.exec_()
     
     def show_reports(self):
-        dialog = ReportsDialog(self)
+        dialog = ReportsDialog(self.service, self.executor, self.report_cache, self)
         dialog.exec_()
     
+    def export_current_tab(self):
+        # Выгружается вся выборка вкладки с текущими поиском и сортировкой
+        model = self.tabs.currentWidget().findChild(SqlTableView).model()
+        sql, params = model.query()
+        headers = [title for title, _ in model.columns]
+        export_with_progress(self, self.executor, sql, params, headers,
+                             f"{model.source.split()[0]}.csv")
+    
     def quick_sale(self):
         self.tabs.setCurrentIndex(3)  # Переходим на вкладку продаж
         self.add_sale()
@@ -1750,8 +2552,23 @@ class MainWindow(QMainWindow):
     def quick_reserve(self):
         self.tabs.setCurrentIndex(4)  # Переходим на вкладку резервов
         self.add_reservation()
+    
+    def closeEvent(self, event):
+        # Прерываем и дожидаемся фоновых запросов, прежде чем закрыть соединения
+        self.sweeper.stop()
+        self.watchdog.stop()
+        self.executor.cancel_all()
+        self.executor.wait()
+        self.db.close()
+        super().closeEvent(event)
 
 def main():
+    # С командой (python main.py rebuild-stats) - обслуживание без окна,
+    # иначе GUI; аргументы Qt начинаются с "-"
+    args = sys.argv[1:]
+    if args and (not args[0].startswith("-") or args[0] in ("--db", "-h", "--help")):
+        sys.exit(run_command(args))
+    
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
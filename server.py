@@ -0,0 +1,328 @@
+# HTTP/JSON API склада для кассовых терминалов и сканеров: python main.py serve.
+# Запись идет через одну очередь писателя с групповым коммитом, чтение - через пул
+# потоков с отдельными соединениями. Только стандартная библиотека, без PyQt5
+import asyncio
+import json
+import queue
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from warehouse import ValidationError, InsufficientStockError, REPORT_QUERIES, logger
+
+MAX_BODY = 1024 * 1024
+
+class HttpError(Exception):
+    def __init__(self, status, message, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+class WriteQueue:
+    # Единственный поток записи. Операции, накопившиеся за время предыдущего
+    # коммита, выполняются одной транзакцией (групповой коммит), каждая в своем
+    # SAVEPOINT - ошибка одной операции откатывает только ее
+    MAX_BATCH = 256
+    
+    def __init__(self, db):
+        self.db = db
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, fn):
+        # fn(conn) выполняется в потоке записи; результат - concurrent.futures.Future
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+    
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        with self.db.pooled() as conn:
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < self.MAX_BATCH:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit(conn, batch)
+    
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            with self.db.transaction(conn):
+                for fn, future in batch:
+                    # Клиент мог отключиться, пока операция ждала в очереди
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with self.db.transaction(conn):
+                            results.append((future, fn(conn), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # Коммит не удался - не записалась ни одна операция пачки
+            logger.exception("Помилка групового коміту")
+            for _, future in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+        
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+class ApiServer:
+    # Маршруты: (метод, шаблон пути, обработчик). Обработчик получает
+    # (совпадение пути, параметры запроса, тело JSON) и возвращает данные ответа
+    def __init__(self, service, readers=4):
+        self.service = service
+        self.db = service.db
+        self.writer = WriteQueue(self.db)
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self.routes = [
+            ("GET", r"/products", self.get_products),
+            ("GET", r"/stock", self.get_stock),
+            ("GET", r"/reports/(\w+)", self.get_report),
+            ("POST", r"/sales", self.post_sale),
+            ("POST", r"/receipts", self.post_receipt),
+            ("POST", r"/reservations", self.post_reservation),
+            ("POST", r"/reservations/(\d+)/(complete|cancel)", self.close_reservation),
+        ]
+        self.routes = [(method, re.compile(pattern + "$"), handler)
+                       for method, pattern, handler in self.routes]
+    
+    async def read(self, fn):
+        def run():
+            with self.db.pooled() as conn:
+                return fn(conn)
+        return await asyncio.get_running_loop().run_in_executor(self.readers, run)
+    
+    async def write(self, fn):
+        return await asyncio.wrap_future(self.writer.submit(fn))
+    
+    def close(self):
+        self.writer.close()
+        self.readers.shutdown()
+    
+    async def run(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Сервер слухає http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+    
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 с keep-alive: терминал отправляет запросы по одному соединению
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HttpError as e:
+            self.write_response(writer, e.status, {"error": str(e)}, False)
+        finally:
+            writer.close()
+    
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            # Некоторые сканеры шлют кириллицу в адресе без %-кодирования
+            method, target, version = line.decode("utf-8", "replace").split()
+        except ValueError:
+            raise HttpError(400, "Некоректний запит")
+        
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if version == "HTTP/1.0" and headers.get("connection", "").lower() != "keep-alive":
+            headers["connection"] = "close"
+        
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "Некоректний Content-Length")
+        if length > MAX_BODY:
+            raise HttpError(413, "Занадто великий запит")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+    
+    def write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+                  405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                  500: "Internal Server Error"}.get(status, "")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + body)
+    
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/") or "/"
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            try:
+                data = json.loads(body) if body else {}
+                if not isinstance(data, dict):
+                    raise HttpError(400, "Очікується JSON-об'єкт")
+                return await handler(match, query, data)
+            except HttpError as e:
+                return e.status, {"error": str(e), **e.details}
+            except (ValidationError, ValueError, KeyError, TypeError) as e:
+                return 400, {"error": str(e)}
+            except InsufficientStockError as e:
+                return 409, {"error": str(e), "shortages": [
+                    {"product_id": product_id, "article": article, "name": name,
+                     "requested": requested, "available": available}
+                    for product_id, article, name, requested, available in e.shortages]}
+            except Exception as e:
+                logger.exception("Помилка обробки %s %s", method, path)
+                return 500, {"error": str(e)}
+        
+        if allowed:
+            return 405, {"error": "Метод не підтримується"}
+        return 404, {"error": "Не знайдено"}
+    
+    async def get_products(self, match, query, data):
+        text = query.get("q", "")
+        # LIMIT -1 в SQLite - без ограничения, поэтому снизу тоже зажимаем
+        limit = max(1, min(int(query.get("limit", 100)), 1000))
+        rows = await self.read(lambda conn: self.service.find_products(text, limit, conn))
+        return 200, [{"id": product_id, "article": article, "name": name,
+                      "retail_price": price, "available": available}
+                     for product_id, article, name, price, available in rows]
+    
+    async def get_stock(self, match, query, data):
+        ids = [int(value) for value in query["ids"].split(",")] if query.get("ids") else None
+        if query.get("as_of"):
+            # Остаток на конец дня по журналу движений
+            rows = await self.read(lambda conn: self.service.stock_as_of(query["as_of"], ids, conn))
+            return 200, [{"id": product_id, "article": article, "name": name, "stock": stock}
+                         for product_id, article, name, stock in rows]
+        rows = await self.read(lambda conn: self.service.stock(ids, conn))
+        return 200, [{"id": product_id, "article": article, "name": name, "stock": stock,
+                      "reserved": reserved, "available": available}
+                     for product_id, article, name, stock, reserved, available in rows]
+    
+    async def get_report(self, match, query, data):
+        name = match.group(1)
+        if name not in REPORT_QUERIES:
+            raise HttpError(404, f"Невідомий звіт '{name}'")
+        headers, rows = await self.read(lambda conn: self.service.report(
+            name, query.get("date_from"), query.get("date_to"), query.get("as_of"), conn=conn))
+        return 200, {"headers": headers, "rows": rows}
+    
+    async def post_sale(self, match, query, data):
+        def post(conn):
+            items = resolve_items(conn, data.get("items"), "retail_price")
+            return self.service.post_sale(
+                data.get("document_number") or f"ВН-{datetime.now():%Y%m%d%H%M%S}",
+                data.get("client_name"), data.get("client_address", ""),
+                data.get("sale_date") or today(), items, conn)
+        return 201, {"id": await self.write(post)}
+    
+    async def post_receipt(self, match, query, data):
+        def post(conn):
+            items = resolve_items(conn, data.get("items"), "purchase_price")
+            return self.service.post_receipt(
+                data.get("document_number") or f"ПН-{datetime.now():%Y%m%d%H%M%S}",
+                data.get("supplier_id"), data.get("receipt_date") or today(), items, conn)
+        return 201, {"id": await self.write(post)}
+    
+    async def post_reservation(self, match, query, data):
+        def post(conn):
+            (product_id, quantity, _), = resolve_items(conn, [data], "retail_price")
+            return self.service.reserve(
+                data.get("client_name"), product_id, quantity,
+                data.get("reservation_date") or today(), data["expiry_date"], conn)
+        return 201, {"id": await self.write(post)}
+    
+    async def close_reservation(self, match, query, data):
+        reservation_id, action = int(match.group(1)), match.group(2)
+        if action == "complete":
+            closed = await self.write(lambda conn: self.service.complete_reservation(reservation_id, conn))
+        else:
+            closed = await self.write(lambda conn: self.service.cancel_reservation(reservation_id, conn))
+        if not closed:
+            raise HttpError(409, "Резерв вже не активний")
+        return 200, {"id": reservation_id}
+
+def today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def resolve_items(conn, items, price_column):
+    # Строки документа из JSON: {"product_id" или "article", "quantity", "price"}.
+    # Артикулы переводятся в id одним запросом; без цены берется price_column товара
+    if not isinstance(items, list) or not items:
+        raise ValidationError("Додайте хоча б один товар!")
+    
+    keys = {("article", item["article"]) if "article" in item else ("id", item.get("product_id"))
+            for item in items}
+    products = {}
+    for column in ("id", "article"):
+        values = [value for key, value in keys if key == column]
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            rows = conn.execute(f"SELECT {column}, id, {price_column} FROM products "
+                                f"WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk)
+            products.update({(column, key): (product_id, price) for key, product_id, price in rows})
+    
+    resolved = []
+    for item in items:
+        key = ("article", item["article"]) if "article" in item else ("id", item.get("product_id"))
+        if key not in products:
+            raise HttpError(404, f"Товар не знайдено: {key[1]}")
+        product_id, default_price = products[key]
+        price = item.get("price")
+        resolved.append((product_id, item.get("quantity", 1),
+                         price if price is not None else default_price or 0))
+    return resolved
+
+def serve(service, host="127.0.0.1", port=8080, readers=4):
+    api = ApiServer(service, readers)
+    try:
+        asyncio.run(api.run(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
@@ -0,0 +1,1885 @@
+# Склад без GUI: база данных, миграции, импорт/экспорт и WarehouseService.
+# Модуль не зависит от PyQt5 - его можно подключать в фоновых заданиях и скриптах
+import sys
+import sqlite3
+import os
+import argparse
+import csv
+import json
+import logging
+import queue
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from time import perf_counter
+
+try:
+    import openpyxl
+except ImportError:  # экспорт в XLSX недоступен, CSV работает всегда
+    openpyxl = None
+
+logger = logging.getLogger("warehouse")
+
+def file_logger(name, path, max_bytes=1024 * 1024, backups=5):
+    # Отдельный журнал с ротацией, не попадающий в stderr. Файл создается
+    # при первой записи; пустой path - записи никуда не пишутся.
+    # Повторный вызов заменяет прежний файл журнала
+    log = logging.getLogger(name)
+    log.propagate = False
+    for handler in log.handlers[:]:
+        log.removeHandler(handler)
+        handler.close()
+    if path:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                      encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    else:
+        handler = logging.NullHandler()
+    log.addHandler(handler)
+    return log
+
+# Настройки SQLite по умолчанию. Любую можно переопределить переменной
+# окружения WAREHOUSE_<КЛЮЧ>, например WAREHOUSE_JOURNAL_MODE=DELETE.
+# WAL работает только если все станции открывают файл с одного хоста;
+# для сетевого диска без разделяемой памяти нужен DELETE или TRUNCATE.
+DB_SETTINGS = {
+    "journal_mode": "WAL",
+    "fallback_journal_mode": "DELETE",  # если файловая система не поддерживает WAL
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,               # мс ожидания блокировки вместо "database is locked"
+    "cache_size": -16000,               # отрицательное значение - размер в KiB
+    "mmap_size": 64 * 1024 * 1024,      # 0 - отключить
+    "checkpoint_interval": 60,          # сек между фоновыми checkpoint, 0 - отключить
+    "query_profile": 1,                 # счетчики времени запросов, 0 - отключить
+    "slow_query_ms": 200,               # порог журнала медленных запросов
+    "slow_query_log": "slow_queries.log",  # файл журнала медленных запросов, "" - только в памяти
+    "query_stats_file": "",             # JSON со статистикой запросов при закрытии
+}
+
+def db_settings_from_env(defaults=DB_SETTINGS):
+    # Переопределения WAREHOUSE_<KEY> из окружения, приведенные к типу значения
+    # по умолчанию. Некорректное значение пропускается с предупреждением
+    settings = {}
+    for key, default in defaults.items():
+        name = f"WAREHOUSE_{key.upper()}"
+        value = os.environ.get(name)
+        if value is None:
+            continue
+        try:
+            settings[key] = type(default)(value)
+        except ValueError:
+            logger.warning("Некоректне значення %s=%r, використано %r", name, value, default)
+    return settings
+
+def add_column(table, column, definition, backfill=None):
+    # Шаг миграции: ALTER TABLE только если колонки еще нет
+    # (старые файлы warehouse.db создавались без некоторых колонок).
+    # backfill - SQL, заполняющий только что добавленную колонку
+    def step(conn):
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            if backfill:
+                conn.execute(backfill)
+    return step
+
+def create_products_fts(conn):
+    # Полнотекстовый индекс по артикулу и названию (триграммы - поиск по подстроке).
+    # Если SQLite собран без FTS5/trigram, поиск остается на LIKE
+    try:
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                article, name,
+                content='products', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning("FTS5 недоступний (%s), пошук товарів працюватиме через LIKE", e)
+        return
+    
+    # Триггеры держат индекс в синхронизации с таблицей товаров
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, article, name) VALUES (new.id, new.article, new.name);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, article, name)
+            VALUES ('delete', old.id, old.article, old.name);
+        END
+    ''')
+    conn.execute(PRODUCTS_FTS_UPDATE_TRIGGER)
+    conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+# Переиндексация только при реальном изменении артикула или названия:
+# обновление цен (в том числе импортом прайса) не трогает индекс поиска
+PRODUCTS_FTS_UPDATE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF article, name ON products
+    WHEN old.article IS NOT new.article OR old.name IS NOT new.name BEGIN
+        INSERT INTO products_fts (products_fts, rowid, article, name)
+        VALUES ('delete', old.id, old.article, old.name);
+        INSERT INTO products_fts (rowid, article, name) VALUES (new.id, new.article, new.name);
+    END
+'''
+
+def replace_fts_update_trigger(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone():
+        conn.execute("DROP TRIGGER IF EXISTS products_fts_update")
+        conn.execute(PRODUCTS_FTS_UPDATE_TRIGGER)
+
+def fill_daily_stats(conn):
+    # Полный пересчет щоденних підсумків по строкам документов
+    conn.execute("DELETE FROM daily_product_stats")
+    conn.execute('''
+        INSERT INTO daily_product_stats (day, product_id, qty_in, qty_out, revenue, cost)
+        SELECT day, product_id, SUM(qty_in), SUM(qty_out), SUM(revenue), SUM(cost) FROM (
+            SELECT r.receipt_date AS day, ri.product_id, ri.quantity AS qty_in, 0 AS qty_out,
+                   0 AS revenue, ri.total AS cost
+            FROM receipt_items ri JOIN receipts r ON ri.receipt_id = r.id
+            
+            UNION ALL
+            
+            SELECT s.sale_date, si.product_id, 0, si.quantity, si.total, 0
+            FROM sale_items si JOIN sales s ON si.sale_id = s.id
+        )
+        WHERE product_id IS NOT NULL
+        GROUP BY day, product_id
+    ''')
+    return conn.execute("SELECT COUNT(*) FROM daily_product_stats").fetchone()[0]
+
+# Остаток товара p на конец дня :as_of - последний снимок не позже этой даты
+# плюс хвост журнала движений после снимка (индексы по (product_id, day))
+STOCK_AS_OF = '''(
+    COALESCE((SELECT stock FROM stock_snapshots s
+              WHERE s.product_id = p.id AND s.day <= :as_of
+              ORDER BY s.day DESC LIMIT 1), 0)
+    + COALESCE((SELECT SUM(qty) FROM stock_ledger l
+                WHERE l.product_id = p.id AND l.day <= :as_of AND l.day > COALESCE((
+                    SELECT MAX(day) FROM stock_snapshots s
+                    WHERE s.product_id = p.id AND s.day <= :as_of), '')), 0)
+)'''
+
+def fill_stock_ledger(conn):
+    # Журнал движений по уже проведенным документам: строка на товар в документе
+    conn.execute('''
+        INSERT INTO stock_ledger (product_id, day, qty, doc_type, doc_id)
+        SELECT product_id, day, qty, doc_type, doc_id FROM (
+            SELECT ri.product_id, r.receipt_date AS day, SUM(ri.quantity) AS qty,
+                   'receipt' AS doc_type, r.id AS doc_id
+            FROM receipt_items ri JOIN receipts r ON ri.receipt_id = r.id
+            GROUP BY r.id, ri.product_id
+            
+            UNION ALL
+            
+            SELECT si.product_id, s.sale_date, -SUM(si.quantity), 'sale', s.id
+            FROM sale_items si JOIN sales s ON si.sale_id = s.id
+            GROUP BY s.id, si.product_id
+        )
+        WHERE product_id IS NOT NULL
+        ORDER BY day, doc_type, doc_id
+    ''')
+
+def _month_end(day):
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def pending_snapshot_days(conn, until=None):
+    # Концы месяцев, на которые еще нет снимка: после последнего снимка
+    # (или с месяца первого движения) и не позже until - конца прошлого месяца
+    until = until or (date.today().replace(day=1) - timedelta(days=1)).isoformat()
+    last = conn.execute("SELECT MAX(day) FROM stock_snapshots").fetchone()[0]
+    start = last or conn.execute("SELECT MIN(day) FROM stock_ledger").fetchone()[0]
+    if start is None:
+        return []
+    
+    days = []
+    day = _month_end(date.fromisoformat(start[:10]))
+    while day.isoformat() <= until:
+        if last is None or day.isoformat() > last:
+            days.append(day.isoformat())
+        day = _month_end(day + timedelta(days=1))
+    return days
+
+def create_stock_snapshots(conn, until=None):
+    # Снимки остатков на концы завершенных месяцев. Снимок пишется только по товарам,
+    # у которых после предыдущего снимка были движения, для остальных верен прежний.
+    # Возвращает число записанных строк
+    written = 0
+    for day in pending_snapshot_days(conn, until):
+        cursor = conn.execute(f'''
+            INSERT OR REPLACE INTO stock_snapshots (product_id, day, stock)
+            SELECT p.id, :as_of, {STOCK_AS_OF} FROM products p
+            WHERE EXISTS (
+                SELECT 1 FROM stock_ledger l
+                WHERE l.product_id = p.id AND l.day <= :as_of AND l.day > COALESCE((
+                    SELECT MAX(day) FROM stock_snapshots s
+                    WHERE s.product_id = p.id AND s.day < :as_of), '')
+            )
+        ''', {"as_of": day})
+        written += cursor.rowcount
+    return written
+
+# Расхождения денормализованных счетчиков с историей: (id, article, name, current_stock,
+# по документам, reserved_qty, по активным резервам, по журналу движений).
+# Суммы по строкам документов читаются по индексам (product_id, quantity) без сортировки.
+# Товары без расхождений не возвращаются
+STOCK_DRIFT_SQL = '''
+    WITH received AS (
+        SELECT product_id, SUM(quantity) AS qty FROM receipt_items GROUP BY product_id
+    ), sold AS (
+        SELECT product_id, SUM(quantity) AS qty FROM sale_items GROUP BY product_id
+    ), reserved AS (
+        SELECT product_id, SUM(quantity) AS qty FROM reservations
+        WHERE status = 'active' GROUP BY product_id
+    ), ledger AS (
+        SELECT product_id, SUM(qty) AS qty FROM stock_ledger GROUP BY product_id
+    )
+    SELECT id, article, name, current_stock, stock, reserved_qty, reserved, ledger FROM (
+        SELECT p.id, p.article, p.name, p.current_stock,
+               COALESCE(rc.qty, 0) - COALESCE(sd.qty, 0) AS stock,
+               p.reserved_qty, COALESCE(r.qty, 0) AS reserved, COALESCE(l.qty, 0) AS ledger
+        FROM products p
+        LEFT JOIN received rc ON rc.product_id = p.id
+        LEFT JOIN sold sd ON sd.product_id = p.id
+        LEFT JOIN reserved r ON r.product_id = p.id
+        LEFT JOIN ledger l ON l.product_id = p.id
+    )
+    WHERE current_stock IS NOT stock OR reserved_qty IS NOT reserved OR ledger != stock
+    ORDER BY id
+'''
+
+# Миграции схемы: (версия, шаги). Шаг - SQL-строка или функция от соединения.
+# Номер последней примененной миграции хранится в PRAGMA user_version.
+MIGRATIONS = [
+    # 1: индексы для строк документов, дат, резервов и сортировки справочников
+    (1, [
+        # Остаток в старых файлах считается по истории документов
+        add_column("products", "current_stock", "INTEGER DEFAULT 0", '''
+            UPDATE products SET current_stock =
+                COALESCE((SELECT SUM(quantity) FROM receipt_items WHERE product_id = products.id), 0)
+                - COALESCE((SELECT SUM(quantity) FROM sale_items WHERE product_id = products.id), 0)
+        '''),
+        # Покрывающие индексы: отчеты и подсчет позиций читают только индекс
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_sale "
+        "ON sale_items (sale_id, product_id, quantity, price)",
+        "CREATE INDEX IF NOT EXISTS idx_receipt_items_receipt "
+        "ON receipt_items (receipt_id, product_id, quantity, price)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_product ON sale_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_receipt_items_product ON receipt_items (product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (sale_date)",
+        "CREATE INDEX IF NOT EXISTS idx_receipts_date ON receipts (receipt_date)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_status_expiry "
+        "ON reservations (status, expiry_date)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_product ON reservations (product_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reservations_date ON reservations (reservation_date)",
+        "CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)",
+        "CREATE INDEX IF NOT EXISTS idx_suppliers_name ON suppliers (name)",
+    ]),
+    # 2: полнотекстовый поиск товаров
+    (2, [
+        create_products_fts,
+    ]),
+    # 3: счетчик зарезервированного количества, доступно = current_stock - reserved_qty
+    (3, [
+        add_column("products", "reserved_qty", "INTEGER NOT NULL DEFAULT 0"),
+        '''
+            UPDATE products SET reserved_qty = COALESCE((
+                SELECT SUM(quantity) FROM reservations
+                WHERE product_id = products.id AND status = 'active'
+            ), 0)
+        ''',
+    ]),
+    # 4: щоденні підсумки по товарах для отчетов за период.
+    # cost - сумма поступлений по закупочным ценам, revenue - сумма продаж
+    (4, [
+        '''
+            CREATE TABLE IF NOT EXISTS daily_product_stats (
+                day DATE NOT NULL,
+                product_id INTEGER NOT NULL,
+                qty_in INTEGER NOT NULL DEFAULT 0,
+                qty_out INTEGER NOT NULL DEFAULT 0,
+                revenue REAL NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, product_id)
+            ) WITHOUT ROWID
+        ''',
+        fill_daily_stats,
+    ]),
+    # 5: триггер индекса поиска срабатывает только при смене артикула или названия
+    (5, [
+        replace_fts_update_trigger,
+    ]),
+    # 6: журнал движений остатков (только добавление) и снимки остатков на конец месяца
+    # для остатка на произвольную дату
+    (6, [
+        '''
+            CREATE TABLE IF NOT EXISTS stock_ledger (
+                id INTEGER PRIMARY KEY,
+                product_id INTEGER NOT NULL,
+                day DATE NOT NULL,
+                qty INTEGER NOT NULL,
+                doc_type TEXT NOT NULL,
+                doc_id INTEGER NOT NULL
+            )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_stock_ledger_product_day ON stock_ledger (product_id, day, qty)",
+        "CREATE INDEX IF NOT EXISTS idx_stock_ledger_doc ON stock_ledger (doc_type, doc_id)",
+        '''
+            CREATE TRIGGER IF NOT EXISTS stock_ledger_no_update BEFORE UPDATE ON stock_ledger
+            BEGIN SELECT RAISE(ABORT, 'stock_ledger: only inserts are allowed'); END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS stock_ledger_no_delete BEFORE DELETE ON stock_ledger
+            BEGIN SELECT RAISE(ABORT, 'stock_ledger: only inserts are allowed'); END
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS stock_snapshots (
+                product_id INTEGER NOT NULL,
+                day DATE NOT NULL,
+                stock INTEGER NOT NULL,
+                PRIMARY KEY (product_id, day)
+            ) WITHOUT ROWID
+        ''',
+        fill_stock_ledger,
+        create_stock_snapshots,
+    ]),
+    # 7: индексы строк документов по товару покрывают количество - сверка остатков
+    # суммирует их без обращения к таблице и без сортировки
+    (7, [
+        "CREATE INDEX IF NOT EXISTS idx_receipt_items_product_qty ON receipt_items (product_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_sale_items_product_qty ON sale_items (product_id, quantity)",
+        "DROP INDEX IF EXISTS idx_receipt_items_product",
+        "DROP INDEX IF EXISTS idx_sale_items_product",
+    ]),
+]
+
+# Отчеты: (заголовки колонок, SQL). Период передается параметрами :date_from и :date_to,
+# дата остатков - :as_of (NULL - текущие остатки)
+REPORT_QUERIES = {
+    "stock": (["Артикул", "Назва", "Категорія", "Залишок", "Ціна", "Загальна вартість"], f'''
+        SELECT article, name, category, stock, retail_price,
+               (stock * retail_price) as total_value
+        FROM (
+            SELECT p.article, p.name, p.category, p.retail_price,
+                   CASE WHEN :as_of IS NULL THEN p.current_stock ELSE {STOCK_AS_OF} END AS stock
+            FROM products p
+        )
+        ORDER BY name
+    '''),
+    "movement": (["Тип", "Номер", "Дата", "Артикул", "Товар", "Кількість", "Ціна", "Контрагент"], '''
+        SELECT 'Надходження' as type, r.document_number, r.receipt_date as date,
+               p.article, p.name, ri.quantity, ri.price, s.name as counterparty
+        FROM receipt_items ri
+        JOIN receipts r ON ri.receipt_id = r.id
+        JOIN products p ON ri.product_id = p.id
+        LEFT JOIN suppliers s ON r.supplier_id = s.id
+        WHERE r.receipt_date BETWEEN :date_from AND :date_to
+        
+        UNION ALL
+        
+        SELECT 'Продаж' as type, s.document_number, s.sale_date as date,
+               p.article, p.name, si.quantity, si.price, s.client_name as counterparty
+        FROM sale_items si
+        JOIN sales s ON si.sale_id = s.id
+        JOIN products p ON si.product_id = p.id
+        WHERE s.sale_date BETWEEN :date_from AND :date_to
+        
+        ORDER BY date DESC
+    '''),
+    # Итоги за период читаются из daily_product_stats, а не из строк документов
+    "summary": (["Артикул", "Назва", "Надійшло", "Продано", "Виручка", "Закупівля"], '''
+        SELECT p.article, p.name, SUM(d.qty_in), SUM(d.qty_out),
+               ROUND(SUM(d.revenue), 2), ROUND(SUM(d.cost), 2)
+        FROM daily_product_stats d
+        JOIN products p ON d.product_id = p.id
+        WHERE d.day BETWEEN :date_from AND :date_to
+        GROUP BY d.product_id
+        ORDER BY p.name
+    '''),
+    "sales": (["Номер", "Дата", "Клієнт", "Кількість позицій", "Сума"], '''
+        SELECT s.document_number, s.sale_date, s.client_name,
+               COUNT(si.id) as items_count, s.total_amount
+        FROM sales s
+        LEFT JOIN sale_items si ON s.id = si.sale_id
+        WHERE s.sale_date BETWEEN :date_from AND :date_to
+        GROUP BY s.id
+        ORDER BY s.sale_date DESC
+    '''),
+}
+
+def report_params(date_from=None, date_to=None, as_of=None):
+    return {"date_from": date_from, "date_to": date_to, "as_of": as_of}
+
+# Таблицы главного окна: (источник FROM, [(заголовок, SQL-выражение)], ключ строки,
+# колонка сортировки по умолчанию, по убыванию)
+TABLE_VIEWS = {
+    "products": ("products", [
+        ("ID", "id"),
+        ("Артикул", "article"),
+        ("Назва", "name"),
+        ("Ціна вх.", "purchase_price"),
+        ("Ціна роздр.", "retail_price"),
+        ("Категорія", "category"),
+        ("Залишок", "current_stock"),
+        ("Резерв", "reserved_qty"),
+        ("Доступно", "current_stock - reserved_qty"),
+    ], "id", 2, False),
+    "suppliers": ("suppliers", [
+        ("ID", "id"),
+        ("Назва", "name"),
+        ("Контакт", "contact_person"),
+        ("Телефон", "phone"),
+        ("Email", "email"),
+    ], "id", 1, False),
+    "receipts": ("receipts r LEFT JOIN suppliers s ON r.supplier_id = s.id", [
+        ("ID", "r.id"),
+        ("Номер", "r.document_number"),
+        ("Дата", "r.receipt_date"),
+        ("Постачальник", "s.name"),
+        ("Сума", "r.total_amount"),
+    ], "r.id", 2, True),
+    "sales": ("sales s", [
+        ("ID", "s.id"),
+        ("Номер", "s.document_number"),
+        ("Дата", "s.sale_date"),
+        ("Клієнт", "s.client_name"),
+        ("Позицій", "(SELECT COUNT(*) FROM sale_items WHERE sale_id = s.id)"),
+        ("Сума", "s.total_amount"),
+    ], "s.id", 2, True),
+    "reservations": ("reservations r JOIN products p ON r.product_id = p.id", [
+        ("ID", "r.id"),
+        ("Клієнт", "r.client_name"),
+        ("Товар", "p.name"),
+        ("Кількість", "r.quantity"),
+        ("Дата резерву", "r.reservation_date"),
+        ("Дійсний до", "r.expiry_date"),
+        ("Статус", "r.status"),
+    ], "r.id", 4, True),
+}
+
+def view_query(source, columns, key, sort_column, descending, where=""):
+    # SELECT таблицы без LIMIT. Ключ вторым полем сортировки - порядок страниц
+    # стабилен при одинаковых значениях
+    direction = "DESC" if descending else "ASC"
+    return f'''
+        SELECT {", ".join(expression for _, expression in columns)} FROM {source}
+        {f"WHERE {where}" if where else ""}
+        ORDER BY {columns[sort_column][1]} {direction}, {key} {direction}
+    '''
+
+EXPORT_CHUNK = 5000
+XLSX_MAX_ROWS = 1048576  # предел строк листа Excel вместе с заголовком
+
+def _export_chunks(cursor, job=None):
+    # Порции строк из курсора; прогресс - число выгруженных строк. Общее число
+    # заранее не считается: COUNT(*) выполнил бы весь запрос второй раз
+    written = 0
+    while job is None or not job.cancelled:
+        chunk = cursor.fetchmany(EXPORT_CHUNK)
+        if not chunk:
+            return
+        yield chunk
+        written += len(chunk)
+        if job is not None:
+            job.report_progress(written)
+
+def write_csv(path, headers, chunks):
+    # ";" и BOM - так файл с кириллицей сразу правильно открывается в Excel
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(headers)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            count += len(chunk)
+    return count
+
+def write_xlsx(path, headers, chunks):
+    if openpyxl is None:
+        raise RuntimeError("Для експорту в XLSX потрібен пакет openpyxl")
+    
+    # write_only: строки сразу уходят во временный файл листа, а не в память.
+    # Не поместившееся в лист продолжается на следующем
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    count = 0
+    for chunk in chunks:
+        for row in chunk:
+            if sheet is None or sheet_rows == XLSX_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Аркуш {len(workbook.worksheets) + 1}")
+                sheet.append(headers)
+                sheet_rows = 1
+            sheet.append(row)
+            sheet_rows += 1
+        count += len(chunk)
+    
+    if sheet is None:
+        workbook.create_sheet("Аркуш 1").append(headers)
+    workbook.save(path)
+    return count
+
+def export_query(conn, sql, params, headers, path, job=None):
+    # Потоковая выгрузка выборки в CSV или XLSX (по расширению файла).
+    # В памяти не больше одной порции строк. Возвращает число выгруженных строк;
+    # при отмене через job недописанный файл удаляется
+    chunks = _export_chunks(conn.execute(sql, params), job)
+    write = write_xlsx if path.lower().endswith(".xlsx") else write_csv
+    try:
+        count = write(path, headers, chunks)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    
+    if job is not None and job.cancelled and os.path.exists(path):
+        os.remove(path)
+    return count
+
+# Колонки файла импорта товаров: поле products -> допустимые заголовки (без регистра)
+PRODUCT_IMPORT_COLUMNS = {
+    "article": ("article", "артикул"),
+    "name": ("name", "назва", "найменування"),
+    "purchase_price": ("purchase_price", "ціна вх.", "ціна закупівлі"),
+    "retail_price": ("retail_price", "ціна роздр.", "ціна"),
+    "supplier": ("supplier", "постачальник"),
+    "category": ("category", "категорія"),
+}
+IMPORT_BATCH = 5000
+
+def _detect_encoding(path):
+    # Прайсы поставщиков приходят и в UTF-8, и в cp1251
+    with open(path, "rb") as f:
+        sample = f.read(65536)
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Ошибка только в обрезанном последнем символе - это все же UTF-8
+        if e.start < len(sample) - 3:
+            return "cp1251"
+    return "utf-8-sig"
+
+def read_table_file(path):
+    # Строки CSV или XLSX по одной: (номер строки в файле, значения). Первая - заголовок
+    if path.lower().endswith(".xlsx"):
+        if openpyxl is None:
+            raise RuntimeError("Для імпорту з XLSX потрібен пакет openpyxl")
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for line_no, row in enumerate(workbook.worksheets[0].iter_rows(values_only=True), 1):
+                yield line_no, row
+        finally:
+            workbook.close()
+        return
+    
+    with open(path, newline="", encoding=_detect_encoding(path)) as f:
+        try:
+            dialect = csv.Sniffer().sniff(f.read(65536), delimiters=";,\t")
+        except csv.Error:
+            dialect = None
+        f.seek(0)
+        reader = csv.reader(f, dialect) if dialect else csv.reader(f, delimiter=";")
+        for row in reader:
+            yield reader.line_num, row
+
+def map_columns(header, known):
+    # {поле: номер колонки} по заголовку файла
+    titles = {str(title).strip().lower(): index
+              for index, title in enumerate(header) if title is not None}
+    columns = {}
+    for field, aliases in known.items():
+        for alias in aliases:
+            if alias in titles:
+                columns[field] = titles[alias]
+                break
+    return columns
+
+def _cell(row, index):
+    value = row[index] if index < len(row) else None
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value == "" else value
+
+def _parse_number(value, title):
+    # Пустая ячейка - None: импорт не затирает ею сохраненное значение
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        number = value
+    else:
+        try:
+            number = float(str(value).replace("\xa0", "").replace(" ", "").replace(",", "."))
+        except ValueError:
+            raise ValueError(f"{title}: не число '{value}'")
+    if number < 0:
+        raise ValueError(f"{title}: від'ємне значення {number}")
+    return number
+
+def _product_values(row, columns):
+    values = []
+    for field, index in columns.items():
+        value = _cell(row, index)
+        if field in ("purchase_price", "retail_price"):
+            value = _parse_number(value, field)
+        elif field in ("article", "name"):
+            if value is None:
+                raise ValueError(f"не заповнено {field}")
+            value = str(value)
+        elif value is not None:
+            value = str(value)
+        values.append(value)
+    return values
+
+def import_products(db, path, conn=None, job=None, batch_size=IMPORT_BATCH):
+    # Потоковый импорт прайса: строки проверяются и пачками по batch_size
+    # записываются через Database.upsert_products (каждая пачка - своя транзакция).
+    # Ошибочные строки пропускаются. Возвращает (записано строк, [(номер строки, ошибка)])
+    rows = read_table_file(path)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("Файл порожній")
+    columns = map_columns(header[1], PRODUCT_IMPORT_COLUMNS)
+    missing = [field for field in ("article", "name") if field not in columns]
+    if missing:
+        raise ValueError("Не знайдено колонки: " + ", ".join(missing))
+    
+    fields = list(columns)
+    batch = []
+    errors = []
+    imported = 0
+    for line_no, row in rows:
+        if job is not None and job.cancelled:
+            return imported, errors
+        if not any(value not in (None, "") for value in row):
+            continue
+        try:
+            batch.append(_product_values(row, columns))
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+            continue
+        
+        if len(batch) >= batch_size:
+            db.upsert_products(fields, batch, conn)
+            imported += len(batch)
+            batch = []
+            if job is not None:
+                job.report_progress(imported)
+    
+    if batch:
+        db.upsert_products(fields, batch, conn)
+        imported += len(batch)
+    return imported, errors
+
+# Колонки файла поставки: артикул, количество и (необязательно) закупочная цена
+RECEIPT_IMPORT_COLUMNS = {
+    "article": ("article", "артикул", "код"),
+    "quantity": ("quantity", "кількість", "к-сть", "qty"),
+    "price": ("price", "ціна", "ціна вх.", "ціна закупівлі"),
+}
+
+def load_article_index(conn):
+    # Артикул -> (id, закупочная цена) одним запросом вместо поиска на каждую строку
+    cursor = conn.execute("SELECT article, id, purchase_price FROM products")
+    return {article: (product_id, price) for article, product_id, price in cursor}
+
+def read_receipt_items(conn, path, job=None):
+    # Строки накладной поставщика из CSV/XLSX -> ([(product_id, quantity, price)],
+    # [(номер строки, ошибка)]). Без колонки цены берется закупочная цена товара
+    rows = read_table_file(path)
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("Файл порожній")
+    columns = map_columns(header[1], RECEIPT_IMPORT_COLUMNS)
+    missing = [field for field in ("article", "quantity") if field not in columns]
+    if missing:
+        raise ValueError("Не знайдено колонки: " + ", ".join(missing))
+    
+    index = load_article_index(conn)
+    items = []
+    errors = []
+    for line_no, row in rows:
+        if job is not None and job.cancelled:
+            break
+        if not any(value not in (None, "") for value in row):
+            continue
+        try:
+            article = _cell(row, columns["article"])
+            if article is None:
+                raise ValueError("не заповнено article")
+            product = index.get(str(article))
+            if product is None:
+                raise ValueError(f"невідомий артикул '{article}'")
+            
+            quantity = _parse_number(_cell(row, columns["quantity"]), "quantity")
+            if quantity is None:
+                raise ValueError("не заповнено quantity")
+            if quantity <= 0 or quantity != int(quantity):
+                raise ValueError(f"quantity: потрібне ціле додатне число, а не {quantity}")
+            if "price" in columns and _cell(row, columns["price"]) is not None:
+                price = _parse_number(_cell(row, columns["price"]), "price")
+            else:
+                price = product[1] or 0
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+            continue
+        items.append((product[0], int(quantity), price))
+    return items, errors
+
+def import_receipt(db, path, document_number, supplier_id, receipt_date, conn=None, job=None):
+    # Накладная проводится целиком через Database.post_receipt или не проводится вовсе:
+    # при ошибках в строках документ не создается.
+    # Возвращает (id документа или None, количество позиций, [(номер строки, ошибка)])
+    conn = conn or db.connection()
+    items, errors = read_receipt_items(conn, path, job)
+    if errors or not items or (job is not None and job.cancelled):
+        return None, len(items), errors
+    receipt_id = db.post_receipt(document_number, supplier_id, receipt_date, items, conn)
+    return receipt_id, len(items), errors
+
+class QueryStats:
+    # Счетчики по тексту запроса: выполнения, время (execute + чтение строк), строки.
+    # Запросы дольше slow_ms пишутся в журнал медленных запросов вместе с планом
+    # EXPLAIN QUERY PLAN - план снимается один раз на текст запроса
+    SLOW_LOG_SIZE = 200
+    
+    def __init__(self, slow_ms=200, log_path=""):
+        self.slow_ms = slow_ms
+        self.log = file_logger("warehouse.slow_queries", log_path)
+        self._lock = threading.Lock()
+        self._statements = {}  # sql -> [выполнений, всего мс, макс. мс, строк]
+        self._plans = {}
+        self.slow = deque(maxlen=self.SLOW_LOG_SIZE)
+        self.since = datetime.now()
+    
+    def record(self, conn, sql, params, elapsed, rows):
+        # Один вызов на выполненный запрос; elapsed - в секундах
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            counters = self._statements.get(sql)
+            if counters is None:
+                counters = self._statements[sql] = [0, 0.0, 0.0, 0]
+            counters[0] += 1
+            counters[1] += elapsed_ms
+            if elapsed_ms > counters[2]:
+                counters[2] = elapsed_ms
+            counters[3] += rows
+        if elapsed_ms >= self.slow_ms:
+            self.record_slow(conn, sql, params, elapsed_ms, rows)
+    
+    def record_slow(self, conn, sql, params, elapsed_ms, rows):
+        plan = self._plans.get(sql)
+        if plan is None and params is not None and sql.lstrip()[:6].upper() in (
+                "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLAC"):
+            try:
+                # Обычный курсор - сам EXPLAIN в статистику не попадает
+                plan = self._plans[sql] = format_plan(
+                    sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall())
+            except sqlite3.Error as e:
+                plan = [f"EXPLAIN: {e}"]
+        
+        entry = {
+            "time": datetime.now().isoformat(timespec="milliseconds"),
+            "thread": threading.current_thread().name,
+            "ms": round(elapsed_ms, 1),
+            "rows": rows,
+            "sql": normalize_sql(sql),
+            "params": repr(params)[:200],
+            "plan": plan or [],
+        }
+        self.slow.append(entry)
+        self.log.warning("Повільний запит %.0f мс, рядків %d: %s\n%s", elapsed_ms, rows,
+                       entry["sql"][:500], "\n".join(entry["plan"]))
+    
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self.slow.clear()
+            self.since = datetime.now()
+    
+    def snapshot(self):
+        # Запросы по убыванию суммарного времени; тексты, отличающиеся только
+        # пробелами, объединяются
+        with self._lock:
+            items = [(sql, list(counters)) for sql, counters in self._statements.items()]
+            slow = list(self.slow)
+        merged = {}
+        for sql, (calls, total, peak, rows) in items:
+            counters = merged.setdefault(normalize_sql(sql), [0, 0.0, 0.0, 0])
+            counters[0] += calls
+            counters[1] += total
+            counters[2] = max(counters[2], peak)
+            counters[3] += rows
+        statements = [
+            {"sql": sql, "calls": calls, "total_ms": round(total, 3),
+             "avg_ms": round(total / calls, 3) if calls else 0.0, "max_ms": round(peak, 3), "rows": rows}
+            for sql, (calls, total, peak, rows) in merged.items()
+        ]
+        statements.sort(key=lambda statement: statement["total_ms"], reverse=True)
+        return {
+            "since": self.since.isoformat(timespec="seconds"),
+            "slow_query_ms": self.slow_ms,
+            "statements": statements,
+            "slow": slow,
+        }
+    
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+
+def normalize_sql(sql):
+    return " ".join(sql.split())
+
+def format_plan(rows):
+    # Строки EXPLAIN QUERY PLAN (id, parent, _, detail) с отступом по вложенности
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+class ProfiledCursor(sqlite3.Cursor):
+    # Курсор с замером времени. Статистика пишется один раз на запрос: изменения -
+    # сразу после execute, SELECT - когда результат дочитан (fetchall, неполная
+    # порция fetchmany, конец итерации) или после fetchone, которым здесь читают
+    # однострочные результаты. Время SELECT - execute плюс чтение строк: основная
+    # работа SQLite идет по мере выборки. Итерация читает строки пачками, чтобы
+    # время обработки строк вызывающим кодом не учитывалось.
+    # Методы базового класса вызываются напрямую, без super() - это горячий путь
+    FETCH_CHUNK = 256
+    _sql = None  # недочитанный SELECT
+    
+    def execute(self, sql, parameters=()):
+        if self._sql is not None:
+            self._finish()
+        started = perf_counter()
+        try:
+            _cursor_execute(self, sql, parameters)
+        except BaseException:
+            self.connection.stats.record(self.connection, sql, parameters, perf_counter() - started, 0)
+            raise
+        elapsed = perf_counter() - started
+        if self.description is None:
+            self.connection.stats.record(self.connection, sql, parameters, elapsed, max(self.rowcount, 0))
+        else:
+            self._sql, self._params, self._elapsed, self._rows = sql, parameters, elapsed, 0
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        if self._sql is not None:
+            self._finish()
+        started = perf_counter()
+        try:
+            sqlite3.Cursor.executemany(self, sql, seq_of_parameters)
+        finally:
+            # Без параметров - план для пачки не снимается
+            self.connection.stats.record(self.connection, sql, None, perf_counter() - started,
+                                         max(self.rowcount, 0))
+        return self
+    
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        self.connection.stats.record(self.connection, sql, self._params, self._elapsed, self._rows)
+    
+    def fetchone(self):
+        sql = self._sql
+        if sql is None:
+            return _cursor_fetchone(self)
+        started = perf_counter()
+        row = _cursor_fetchone(self)
+        elapsed = self._elapsed + perf_counter() - started
+        self._sql = None
+        self.connection.stats.record(self.connection, sql, self._params, elapsed, self._rows + (row is not None))
+        return row
+    
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        if self._sql is None:
+            return _cursor_fetchmany(self, size)
+        started = perf_counter()
+        rows = _cursor_fetchmany(self, size)
+        self._elapsed += perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+    
+    def fetchall(self):
+        sql = self._sql
+        if sql is None:
+            return _cursor_fetchall(self)
+        started = perf_counter()
+        rows = _cursor_fetchall(self)
+        elapsed = self._elapsed + perf_counter() - started
+        self._sql = None
+        self.connection.stats.record(self.connection, sql, self._params, elapsed, self._rows + len(rows))
+        return rows
+    
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.FETCH_CHUNK)
+            yield from rows
+            if len(rows) < self.FETCH_CHUNK:
+                return
+
+_cursor_execute = sqlite3.Cursor.execute
+_cursor_fetchone = sqlite3.Cursor.fetchone
+_cursor_fetchmany = sqlite3.Cursor.fetchmany
+_cursor_fetchall = sqlite3.Cursor.fetchall
+_connection_cursor = sqlite3.Connection.cursor
+
+class ProfiledConnection(sqlite3.Connection):
+    # Connection.execute в sqlite3 не вызывает Cursor.execute, поэтому
+    # сокращенные методы соединения тоже идут через ProfiledCursor
+    stats = None
+    
+    def cursor(self, factory=ProfiledCursor):
+        return _connection_cursor(self, factory)
+    
+    def execute(self, sql, parameters=()):
+        return _connection_cursor(self, ProfiledCursor).execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return _connection_cursor(self, ProfiledCursor).executemany(sql, seq_of_parameters)
+
+class InsufficientStockError(Exception):
+    # Проведение отклонено: по части товаров не хватает остатка
+    def __init__(self, shortages):
+        # shortages: [(product_id, article, name, requested, available)]
+        self.shortages = shortages
+        super().__init__("Недостатньо товару на складі: " + ", ".join(
+            f"{article} (запитується {requested}, наявно {available})"
+            for _, article, _, requested, available in shortages))
+
+class Database:
+    def __init__(self, db_name="warehouse.db", pool_size=4, settings=None):
+        self.db_name = db_name
+        self.pool_size = pool_size
+        self.settings = {**DB_SETTINGS, **db_settings_from_env(), **(settings or {})}
+        
+        # Пул соединений для рабочих потоков
+        self._pool = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._pool_connections = []
+        
+        # Статистика запросов всех соединений этой базы
+        self.stats = (QueryStats(self.settings["slow_query_ms"], self.settings["slow_query_log"])
+                      if self.settings["query_profile"] else None)
+        
+        # Подписчики на изменения данных и изменения незавершенных транзакций
+        self._listeners = []
+        self._pending_changes = {}  # соединение -> {таблица: {"inserted": ids, "updated": ids}}
+        
+        # Долгоживущее соединение потока GUI (того, кто создал Database)
+        self._owner_thread = threading.get_ident()
+        self.conn = self._connect()
+        self.journal_mode = self._set_journal_mode()
+        self.init_db()
+        
+        # Фоновый checkpoint не дает WAL-файлу разрастаться между сеансами
+        self._stop_event = threading.Event()
+        self._checkpointer = None
+        if self.journal_mode == "wal" and self.settings["checkpoint_interval"] > 0:
+            self._checkpointer = threading.Thread(
+                target=self._checkpoint_loop, name="wal-checkpoint", daemon=True)
+            self._checkpointer.start()
+    
+    def _connect(self, check_same_thread=True):
+        conn = sqlite3.connect(self.db_name, check_same_thread=check_same_thread,
+                               timeout=self.settings["busy_timeout"] / 1000,
+                               factory=ProfiledConnection if self.stats is not None else sqlite3.Connection)
+        if self.stats is not None:
+            conn.stats = self.stats
+        self._apply_pragmas(conn)
+        return conn
+    
+    def _apply_pragmas(self, conn):
+        # Настройки соединения применяются один раз при его создании
+        conn.execute(f"PRAGMA busy_timeout = {int(self.settings['busy_timeout'])}")
+        conn.execute(f"PRAGMA synchronous = {self.settings['synchronous']}")
+        conn.execute(f"PRAGMA cache_size = {int(self.settings['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.settings['mmap_size'])}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+    
+    def _set_journal_mode(self):
+        # Режим журнала хранится в самом файле БД, достаточно выставить его один раз
+        requested = self.settings["journal_mode"].lower()
+        try:
+            mode = self.conn.execute(f"PRAGMA journal_mode = {requested}").fetchone()[0]
+        except sqlite3.OperationalError as e:
+            # Другая станция держит файл открытым - оставляем текущий режим
+            logger.warning("Не вдалося змінити journal_mode на %s: %s", requested, e)
+            mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        
+        if mode.lower() != requested:
+            fallback = self.settings["fallback_journal_mode"].lower()
+            logger.warning("journal_mode %s не підтримується (%s), використовується %s",
+                           requested, mode, fallback)
+            if mode.lower() != fallback:
+                mode = self.conn.execute(f"PRAGMA journal_mode = {fallback}").fetchone()[0]
+        return mode.lower()
+    
+    def _checkpoint_loop(self):
+        while not self._stop_event.wait(self.settings["checkpoint_interval"]):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                logger.warning("Помилка checkpoint: %s", e)
+    
+    def checkpoint(self, mode="PASSIVE"):
+        # PASSIVE не ждет читателей и писателей, переносит то, что можно
+        with self.pooled() as conn:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    
+    def data_version(self):
+        # Меняется после любой записи: data_version - коммиты других соединений,
+        # total_changes - изменения, сделанные через основное соединение
+        conn = self.connection()
+        return conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes
+    
+    def connection(self):
+        if threading.get_ident() != self._owner_thread:
+            raise RuntimeError("Основне з'єднання доступне лише з потоку GUI, "
+                               "використовуйте Database.pooled()")
+        return self.conn
+    
+    def acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._pool_lock:
+            if len(self._pool_connections) < self.pool_size:
+                conn = self._connect(check_same_thread=False)
+                self._pool_connections.append(conn)
+                return conn
+        
+        # Все соединения заняты - ждем освобождения
+        return self._pool.get()
+    
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put(conn)
+    
+    @contextmanager
+    def pooled(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close(self):
+        if self._checkpointer is not None:
+            self._stop_event.set()
+            self._checkpointer.join()
+            self._checkpointer = None
+        
+        with self._pool_lock:
+            for conn in self._pool_connections:
+                conn.close()
+            self._pool_connections = []
+            self._pool = queue.LifoQueue()
+        
+        if self.journal_mode == "wal":
+            try:
+                # Последняя станция при закрытии сбрасывает WAL в основной файл
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logger.warning("Помилка checkpoint при закритті: %s", e)
+        self.conn.close()
+        
+        if self.stats is not None and self.settings["query_stats_file"]:
+            try:
+                self.stats.dump(self.settings["query_stats_file"])
+            except OSError as e:
+                logger.warning("Не вдалося записати статистику запитів: %s", e)
+    
+    def subscribe(self, callback):
+        # callback(changes) вызывается после коммита transaction() в потоке, который писал.
+        # changes: {таблица: {"inserted": set(id), "updated": set(id)}}
+        self._listeners.append(callback)
+    
+    def record_change(self, conn, table, kind, ids):
+        # Запоминает измененные строки до коммита; kind - "inserted" или "updated"
+        changes = self._pending_changes.get(conn)
+        if changes is not None:
+            table_changes = changes.setdefault(table, {"inserted": set(), "updated": set()})
+            table_changes[kind].update(ids)
+    
+    def _notify(self, changes):
+        for callback in list(self._listeners):
+            try:
+                callback(changes)
+            except Exception:
+                logger.exception("Помилка в обробнику змін даних")
+    
+    @contextmanager
+    def transaction(self, conn=None):
+        # BEGIN IMMEDIATE берет блокировку записи сразу, а не на первом UPDATE,
+        # поэтому транзакция не упадет посередине из-за другой станции.
+        # Внутри уже открытой транзакции работает как SAVEPOINT.
+        # Подписчики узнают об изменениях только после коммита внешней транзакции
+        conn = conn or self.connection()
+        if conn.in_transaction:
+            changes = self._pending_changes.get(conn)
+            saved = ({table: {kind: set(ids) for kind, ids in rows.items()}
+                      for table, rows in changes.items()} if changes is not None else None)
+            conn.execute("SAVEPOINT nested")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK TO nested")
+                conn.execute("RELEASE nested")
+                if saved is not None:
+                    self._pending_changes[conn] = saved
+                raise
+            conn.execute("RELEASE nested")
+            return
+        
+        self._pending_changes[conn] = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            self._pending_changes.pop(conn, None)
+            raise
+        conn.commit()
+        
+        changes = self._pending_changes.pop(conn, None)
+        if changes:
+            self._notify(changes)
+    
+    def post_receipt(self, document_number, supplier_id, receipt_date, items, conn=None):
+        # items: [(product_id, quantity, price)]. Возвращает id документа
+        total_amount = sum(quantity * price for _, quantity, price in items)
+        
+        with self.transaction(conn) as conn:
+            cursor = conn.cursor()
+            
+            # Заголовок сразу с итоговой суммой
+            cursor.execute('''
+                INSERT INTO receipts (document_number, supplier_id, receipt_date, total_amount)
+                VALUES (?, ?, ?, ?)
+            ''', (document_number, supplier_id, receipt_date, total_amount))
+            receipt_id = cursor.lastrowid
+            
+            cursor.executemany('''
+                INSERT INTO receipt_items (receipt_id, product_id, quantity, price, total)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(receipt_id, product_id, quantity, price, quantity * price)
+                  for product_id, quantity, price in items])
+            
+            # Остатки одним UPDATE: количества по товару суммируются по строкам документа
+            cursor.execute('''
+                UPDATE products SET current_stock = current_stock + (
+                    SELECT SUM(quantity) FROM receipt_items
+                    WHERE receipt_id = :doc AND product_id = products.id
+                )
+                WHERE id IN (SELECT product_id FROM receipt_items WHERE receipt_id = :doc)
+            ''', {"doc": receipt_id})
+            
+            # Щоденні підсумки обновляются в той же транзакции
+            cursor.execute('''
+                INSERT INTO daily_product_stats (day, product_id, qty_in, cost)
+                SELECT :day, product_id, SUM(quantity), SUM(total) FROM receipt_items
+                WHERE receipt_id = :doc GROUP BY product_id
+                ON CONFLICT (day, product_id) DO UPDATE SET
+                    qty_in = qty_in + excluded.qty_in, cost = cost + excluded.cost
+            ''', {"day": receipt_date, "doc": receipt_id})
+            
+            self._append_ledger(cursor, "receipt", receipt_id, receipt_date)
+            self.record_change(conn, "receipts", "inserted", [receipt_id])
+            self.record_change(conn, "products", "updated", [product_id for product_id, _, _ in items])
+        
+        return receipt_id
+    
+    def post_sale(self, document_number, client_name, client_address, sale_date, items, conn=None):
+        # items: [(product_id, quantity, price)]. Возвращает id документа
+        total_amount = sum(quantity * price for _, quantity, price in items)
+        
+        with self.transaction(conn) as conn:
+            cursor = conn.cursor()
+            
+            # Заголовок сразу с итоговой суммой
+            cursor.execute('''
+                INSERT INTO sales (document_number, client_name, client_address, sale_date, total_amount)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (document_number, client_name, client_address, sale_date, total_amount))
+            sale_id = cursor.lastrowid
+            
+            cursor.executemany('''
+                INSERT INTO sale_items (sale_id, product_id, quantity, price, total)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(sale_id, product_id, quantity, price, quantity * price)
+                  for product_id, quantity, price in items])
+            
+            # Проверка и списание остатков одним условным UPDATE внутри транзакции:
+            # другая станция не успеет списать тот же товар между проверкой и записью.
+            # Зарезервированное количество продать нельзя
+            cursor.execute("SAVEPOINT stock_check")
+            cursor.execute('''
+                UPDATE products SET current_stock = current_stock - (
+                    SELECT SUM(quantity) FROM sale_items
+                    WHERE sale_id = :doc AND product_id = products.id
+                )
+                WHERE id IN (SELECT product_id FROM sale_items WHERE sale_id = :doc)
+                  AND current_stock - reserved_qty >= (
+                    SELECT SUM(quantity) FROM sale_items
+                    WHERE sale_id = :doc AND product_id = products.id
+                )
+            ''', {"doc": sale_id})
+            
+            if cursor.rowcount != len({product_id for product_id, _, _ in items}):
+                # Откатываем частичное списание и собираем товары, которых не хватило
+                cursor.execute("ROLLBACK TO stock_check")
+                cursor.execute('''
+                    SELECT p.id, p.article, p.name, SUM(si.quantity), p.current_stock - p.reserved_qty
+                    FROM sale_items si
+                    JOIN products p ON si.product_id = p.id
+                    WHERE si.sale_id = ?
+                    GROUP BY p.id
+                    HAVING SUM(si.quantity) > p.current_stock - p.reserved_qty
+                ''', (sale_id,))
+                raise InsufficientStockError(cursor.fetchall())
+            cursor.execute("RELEASE stock_check")
+            
+            cursor.execute('''
+                INSERT INTO daily_product_stats (day, product_id, qty_out, revenue)
+                SELECT :day, product_id, SUM(quantity), SUM(total) FROM sale_items
+                WHERE sale_id = :doc GROUP BY product_id
+                ON CONFLICT (day, product_id) DO UPDATE SET
+                    qty_out = qty_out + excluded.qty_out, revenue = revenue + excluded.revenue
+            ''', {"day": sale_date, "doc": sale_id})
+            
+            self._append_ledger(cursor, "sale", sale_id, sale_date)
+            self.record_change(conn, "sales", "inserted", [sale_id])
+            self.record_change(conn, "products", "updated", [product_id for product_id, _, _ in items])
+        
+        return sale_id
+    
+    def _append_ledger(self, cursor, doc_type, doc_id, day):
+        # Движения документа в журнал остатков: строка на товар, продажа со знаком минус
+        items, column, sign = {"receipt": ("receipt_items", "receipt_id", 1),
+                               "sale": ("sale_items", "sale_id", -1)}[doc_type]
+        params = {"type": doc_type, "doc": doc_id, "day": day}
+        cursor.execute(f'''
+            INSERT INTO stock_ledger (product_id, day, qty, doc_type, doc_id)
+            SELECT product_id, :day, {sign} * SUM(quantity), :type, :doc FROM {items}
+            WHERE {column} = :doc GROUP BY product_id
+        ''', params)
+        
+        # Документ задним числом сдвигает уже снятые после его даты снимки
+        cursor.execute('''
+            UPDATE stock_snapshots SET stock = stock + (
+                SELECT qty FROM stock_ledger
+                WHERE doc_type = :type AND doc_id = :doc AND product_id = stock_snapshots.product_id
+            )
+            WHERE day >= :day AND product_id IN (
+                SELECT product_id FROM stock_ledger WHERE doc_type = :type AND doc_id = :doc
+            )
+        ''', params)
+    
+    def create_stock_snapshots(self, until=None, conn=None):
+        # Запись открывается, только если есть месяцы без снимка
+        conn = conn or self.connection()
+        if not pending_snapshot_days(conn, until):
+            return 0
+        with self.transaction(conn) as conn:
+            return create_stock_snapshots(conn, until)
+    
+    def verify_stock(self, conn=None):
+        # Только чтение: расхождения в формате STOCK_DRIFT_SQL
+        conn = conn or self.connection()
+        return conn.execute(STOCK_DRIFT_SQL).fetchall()
+    
+    def rebuild_stock(self, conn=None):
+        # Приводит current_stock и reserved_qty к истории документов и резервов.
+        # Журнал движений только дописывается: его расхождение закрывается
+        # строкой 'correction' сегодняшним днем. Возвращает исправленные расхождения
+        with self.transaction(conn) as conn:
+            conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS stock_drift (
+                    id INTEGER PRIMARY KEY, article, name, current_stock, stock,
+                    reserved_qty, reserved, ledger
+                )
+            ''')
+            conn.execute("DELETE FROM temp.stock_drift")
+            conn.execute("INSERT INTO temp.stock_drift " + STOCK_DRIFT_SQL)
+            drift = conn.execute("SELECT * FROM temp.stock_drift ORDER BY id").fetchall()
+            if not drift:
+                return []
+            
+            conn.execute('''
+                UPDATE products SET
+                    current_stock = (SELECT stock FROM temp.stock_drift d WHERE d.id = products.id),
+                    reserved_qty = (SELECT reserved FROM temp.stock_drift d WHERE d.id = products.id)
+                WHERE id IN (SELECT id FROM temp.stock_drift)
+            ''')
+            conn.execute('''
+                INSERT INTO stock_ledger (product_id, day, qty, doc_type, doc_id)
+                SELECT id, :day, stock - ledger, 'correction', 0 FROM temp.stock_drift
+                WHERE stock != ledger
+            ''', {"day": date.today().isoformat()})
+            
+            self.record_change(conn, "products", "updated", [row[0] for row in drift])
+            return drift
+    
+    def rebuild_daily_stats(self, conn=None):
+        # Пересчитывает daily_product_stats с нуля, возвращает число строк итогов
+        with self.transaction(conn) as conn:
+            return fill_daily_stats(conn)
+    
+    def upsert_products(self, columns, rows, conn=None):
+        # Вставка или обновление товаров по артикулу одной транзакцией.
+        # columns - поля products в строках rows (среди них article). Строки без
+        # изменений не переписываются и не трогают индекс поиска. Пустое значение (None)
+        # оставляет сохраненное у существующего товара, у нового цена пустая - 0
+        names = ", ".join(columns)
+        updates = [column for column in columns if column != "article"]
+        values = ", ".join(
+            "i.article" if column == "article" else
+            f"COALESCE(i.{column}, p.{column}, 0)" if column in ("purchase_price", "retail_price") else
+            f"COALESCE(i.{column}, p.{column})"
+            for column in columns)
+        with self.transaction(conn) as conn:
+            # Пачка сначала ложится во временную таблицу: один INSERT ... SELECT
+            # обновляет индекс поиска в разы быстрее построчного executemany.
+            # При повторе артикула в пачке побеждает последняя строка
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS import_products "
+                         f"({', '.join(PRODUCT_IMPORT_COLUMNS)})")
+            conn.execute("DELETE FROM temp.import_products")
+            conn.executemany(f"INSERT INTO temp.import_products ({names}) "
+                             f"VALUES ({', '.join('?' * len(columns))})", rows)
+            conn.execute(f'''
+                INSERT INTO products ({names})
+                SELECT {values} FROM temp.import_products i
+                LEFT JOIN products p ON p.article = i.article
+                WHERE true ORDER BY i.rowid
+                ON CONFLICT (article) DO UPDATE SET
+                    {", ".join(f"{column} = excluded.{column}" for column in updates)}
+                WHERE {" OR ".join(f"{column} IS NOT excluded.{column}" for column in updates)}
+            ''')
+    
+    def available_stock(self, product_id, conn=None):
+        conn = conn or self.connection()
+        row = conn.execute("SELECT current_stock - reserved_qty FROM products WHERE id = ?",
+                           (product_id,)).fetchone()
+        return row[0] if row else 0
+    
+    def create_reservation(self, client_name, product_id, quantity, reservation_date,
+                           expiry_date, conn=None):
+        with self.transaction(conn) as conn:
+            cursor = conn.cursor()
+            
+            # Резерв уменьшает доступное количество; условие защищает от перерезервирования
+            cursor.execute('''
+                UPDATE products SET reserved_qty = reserved_qty + :qty
+                WHERE id = :id AND current_stock - reserved_qty >= :qty
+            ''', {"id": product_id, "qty": quantity})
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                    SELECT id, article, name, ?, current_stock - reserved_qty
+                    FROM products WHERE id = ?
+                ''', (quantity, product_id))
+                raise InsufficientStockError(cursor.fetchall())
+            
+            cursor.execute('''
+                INSERT INTO reservations (client_name, product_id, quantity, reservation_date, expiry_date)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (client_name, product_id, quantity, reservation_date, expiry_date))
+            reservation_id = cursor.lastrowid
+            
+            self.record_change(conn, "reservations", "inserted", [reservation_id])
+            self.record_change(conn, "products", "updated", [product_id])
+            return reservation_id
+    
+    def complete_reservation(self, reservation_id, conn=None):
+        return self._close_reservation(reservation_id, "completed", conn)
+    
+    def cancel_reservation(self, reservation_id, conn=None):
+        return self._close_reservation(reservation_id, "cancelled", conn)
+    
+    def expire_reservations(self, today=None, conn=None):
+        # Переводит просроченные активные резервы в 'expired' и освобождает их количество.
+        # Возвращает (id резервов, id товаров), которых это коснулось
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        
+        # Запись открывается, только если есть что закрывать: фоновая проверка
+        # каждой станции не берет блокировку записи впустую
+        conn = conn or self.connection()
+        if conn.execute('''
+            SELECT 1 FROM reservations WHERE status = 'active' AND expiry_date < ? LIMIT 1
+        ''', (today,)).fetchone() is None:
+            return [], []
+        
+        with self.transaction(conn) as conn:
+            cursor = conn.cursor()
+            # Одна выборка по индексу (status, expiry_date); перечитываем под блокировкой -
+            # другая станция могла закрыть резервы раньше
+            cursor.execute('''
+                SELECT id, product_id, quantity FROM reservations
+                WHERE status = 'active' AND expiry_date < ?
+            ''', (today,))
+            expired = cursor.fetchall()
+            if not expired:
+                return [], []
+            
+            released = {}
+            for _, product_id, quantity in expired:
+                released[product_id] = released.get(product_id, 0) + quantity
+            
+            cursor.execute('''
+                UPDATE reservations SET status = 'expired'
+                WHERE status = 'active' AND expiry_date < ?
+            ''', (today,))
+            cursor.executemany("UPDATE products SET reserved_qty = reserved_qty - ? WHERE id = ?",
+                               [(quantity, product_id) for product_id, quantity in released.items()])
+            
+            reservation_ids = [reservation_id for reservation_id, _, _ in expired]
+            self.record_change(conn, "reservations", "updated", reservation_ids)
+            self.record_change(conn, "products", "updated", released)
+        
+        return reservation_ids, list(released)
+    
+    def _close_reservation(self, reservation_id, status, conn=None):
+        # Закрыть можно только активный резерв; его количество снова доступно
+        with self.transaction(conn) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT product_id, quantity FROM reservations WHERE id = ? AND status = 'active'",
+                           (reservation_id,))
+            reservation = cursor.fetchone()
+            if reservation is None:
+                return False
+            
+            product_id, quantity = reservation
+            cursor.execute("UPDATE reservations SET status = ? WHERE id = ?", (status, reservation_id))
+            cursor.execute("UPDATE products SET reserved_qty = reserved_qty - ? WHERE id = ?",
+                           (quantity, product_id))
+            
+            self.record_change(conn, "reservations", "updated", [reservation_id])
+            self.record_change(conn, "products", "updated", [product_id])
+            return True
+    
+    def init_db(self):
+        conn = self.conn
+        cursor = conn.cursor()
+        
+        # Таблица товаров
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                article TEXT UNIQUE NOT NULL,
+                name TEXT NOT NULL,
+                purchase_price REAL DEFAULT 0,
+                retail_price REAL DEFAULT 0,
+                supplier TEXT,
+                category TEXT,
+                min_stock INTEGER DEFAULT 0,
+                current_stock INTEGER DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Таблица поставщиков
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS suppliers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                contact_person TEXT,
+                phone TEXT,
+                email TEXT,
+                address TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Таблица поступлений
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_number TEXT NOT NULL,
+                supplier_id INTEGER,
+                receipt_date DATE NOT NULL,
+                total_amount REAL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (supplier_id) REFERENCES suppliers (id)
+            )
+        ''')
+        
+        # Таблица строк поступлений
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                receipt_id INTEGER,
+                product_id INTEGER,
+                quantity INTEGER NOT NULL,
+                price REAL NOT NULL,
+                total REAL NOT NULL,
+                FOREIGN KEY (receipt_id) REFERENCES receipts (id),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        # Таблица продаж (накладные)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_number TEXT NOT NULL,
+                client_name TEXT NOT NULL,
+                client_address TEXT,
+                sale_date DATE NOT NULL,
+                total_amount REAL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Таблица строк продаж
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sale_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sale_id INTEGER,
+                product_id INTEGER,
+                quantity INTEGER NOT NULL,
+                price REAL NOT NULL,
+                total REAL NOT NULL,
+                FOREIGN KEY (sale_id) REFERENCES sales (id),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        # Таблица резервов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_name TEXT NOT NULL,
+                product_id INTEGER,
+                quantity INTEGER NOT NULL,
+                reservation_date DATE NOT NULL,
+                expiry_date DATE NOT NULL,
+                status TEXT DEFAULT 'active',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )
+        ''')
+        
+        conn.commit()
+        
+        self.migrate()
+    
+    def schema_version(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+    
+    def migrate(self):
+        conn = self.conn
+        applied = False
+        
+        for version, steps in MIGRATIONS:
+            if version <= self.schema_version():
+                continue
+            
+            # IMMEDIATE: две станции не применят одну миграцию одновременно
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Перепроверяем внутри транзакции - другая станция могла успеть раньше
+                if version <= self.schema_version():
+                    conn.rollback()
+                    continue
+                
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+                applied = True
+            except Exception:
+                conn.rollback()
+                raise
+        
+        if applied:
+            # Статистика для планировщика по новым индексам
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("ANALYZE")
+            conn.commit()
+        
+        self.has_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone() is not None
+
+class ValidationError(ValueError):
+    # Документ отклонен до записи в БД: не заполнены или неверны поля
+    pass
+
+def product_search_filter(text, has_fts):
+    # Условие поиска: слова от 3 символов ищутся через FTS (триграммы),
+    # более короткие - через LIKE. Все слова должны встретиться в товаре
+    words = text.split()
+    fts_words = [word for word in words if len(word) >= 3] if has_fts else []
+    conditions = []
+    params = []
+    
+    if fts_words:
+        conditions.append("id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+        params.append(" ".join('"' + word.replace('"', '""') + '"' for word in fts_words))
+    
+    for word in words:
+        if word not in fts_words:
+            conditions.append("(name LIKE ? OR article LIKE ?)")
+            params.extend([f"%{word}%"] * 2)
+    
+    return " AND ".join(conditions), params
+
+class WarehouseService:
+    # Операции склада без GUI: проведение документов, резервы, остатки и отчеты.
+    # Проверки документов живут здесь, диалоги только собирают значения из виджетов.
+    # conn - соединение пула для вызова из рабочего потока, по умолчанию основное
+    def __init__(self, db):
+        self.db = db
+    
+    def _check_items(self, items):
+        # items: [(product_id, quantity, price)]
+        if not items:
+            raise ValidationError("Додайте хоча б один товар!")
+        for product_id, quantity, price in items:
+            if not product_id:
+                raise ValidationError("Оберіть товар!")
+            if quantity <= 0 or quantity != int(quantity):
+                raise ValidationError(f"Кількість має бути цілим додатним числом: {quantity}")
+            if price < 0:
+                raise ValidationError(f"Ціна не може бути від'ємною: {price}")
+    
+    def post_receipt(self, document_number, supplier_id, receipt_date, items, conn=None):
+        if not supplier_id:
+            raise ValidationError("Оберіть постачальника!")
+        self._check_items(items)
+        return self.db.post_receipt(document_number, supplier_id, receipt_date, items, conn)
+    
+    def post_sale(self, document_number, client_name, client_address, sale_date, items, conn=None):
+        # Нехватка остатка - InsufficientStockError со списком товаров
+        client_name = (client_name or "").strip()
+        if not client_name:
+            raise ValidationError("Введіть ім'я клієнта!")
+        self._check_items(items)
+        return self.db.post_sale(document_number, client_name, client_address, sale_date, items, conn)
+    
+    def reserve(self, client_name, product_id, quantity, reservation_date, expiry_date, conn=None):
+        client_name = (client_name or "").strip()
+        if not client_name:
+            raise ValidationError("Введіть ім'я клієнта!")
+        self._check_items([(product_id, quantity, 0)])
+        return self.db.create_reservation(client_name, product_id, quantity,
+                                          reservation_date, expiry_date, conn)
+    
+    def complete_reservation(self, reservation_id, conn=None):
+        return self.db.complete_reservation(reservation_id, conn)
+    
+    def cancel_reservation(self, reservation_id, conn=None):
+        return self.db.cancel_reservation(reservation_id, conn)
+    
+    def expire_reservations(self, today=None, conn=None):
+        return self.db.expire_reservations(today, conn)
+    
+    def read_receipt_items(self, path, conn=None, job=None):
+        return read_receipt_items(conn or self.db.connection(), path, job)
+    
+    def import_receipt(self, path, document_number, supplier_id, receipt_date, conn=None, job=None):
+        if not supplier_id:
+            raise ValidationError("Оберіть постачальника!")
+        return import_receipt(self.db, path, document_number, supplier_id, receipt_date, conn, job)
+    
+    def import_products(self, path, conn=None, job=None):
+        return import_products(self.db, path, conn, job)
+    
+    def suppliers(self, conn=None):
+        conn = conn or self.db.connection()
+        return conn.execute("SELECT id, name FROM suppliers ORDER BY name").fetchall()
+    
+    def find_products(self, text="", limit=100, conn=None):
+        # [(id, article, name, retail_price, доступно)]
+        conn = conn or self.db.connection()
+        where, params = product_search_filter(text, self.db.has_fts)
+        return conn.execute(f'''
+            SELECT id, article, name, retail_price, current_stock - reserved_qty
+            FROM products {"WHERE " + where if where else ""}
+            ORDER BY name, id LIMIT ?
+        ''', (*params, limit)).fetchall()
+    
+    def stock(self, product_ids=None, conn=None):
+        # [(id, article, name, current_stock, reserved_qty, доступно)];
+        # без product_ids - по всем товарам
+        conn = conn or self.db.connection()
+        sql = '''
+            SELECT id, article, name, current_stock, reserved_qty, current_stock - reserved_qty
+            FROM products
+        '''
+        if product_ids is None:
+            return conn.execute(sql + " ORDER BY name, id").fetchall()
+        
+        ids = list(set(product_ids))
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows.extend(conn.execute(sql + f" WHERE id IN ({', '.join('?' * len(chunk))})", chunk))
+        return rows
+    
+    def stock_as_of(self, day, product_ids=None, conn=None):
+        # [(id, article, name, остаток на конец дня day)] по журналу и снимкам
+        conn = conn or self.db.connection()
+        sql = f"SELECT p.id, p.article, p.name, {STOCK_AS_OF} FROM products p"
+        if product_ids is None:
+            return conn.execute(sql + " ORDER BY p.name, p.id", {"as_of": day}).fetchall()
+        
+        ids = list(set(product_ids))
+        rows = []
+        for start in range(0, len(ids), 500):
+            chunk = {f"id{index}": product_id for index, product_id in enumerate(ids[start:start + 500])}
+            rows.extend(conn.execute(sql + f" WHERE p.id IN ({', '.join(':' + key for key in chunk)})",
+                                     {"as_of": day, **chunk}))
+        return rows
+    
+    def verify_stock(self, conn=None):
+        return self.db.verify_stock(conn)
+    
+    def rebuild_stock(self, conn=None):
+        return self.db.rebuild_stock(conn)
+    
+    def checkpoint_stock(self, until=None, conn=None):
+        # Снимки остатков на концы завершенных месяцев, которых еще нет
+        return self.db.create_stock_snapshots(until, conn)
+    
+    def _check_period(self, name, sql, date_from, date_to, as_of):
+        # Отчет за период без дат отдал бы пустой результат - ошибка вместо этого
+        if ":date_from" in sql and not (date_from and date_to):
+            raise ValidationError(f"Для звіту '{name}' вкажіть період: date_from і date_to")
+        for value in (date_from, date_to, as_of):
+            if value:
+                try:
+                    date.fromisoformat(value)
+                except ValueError:
+                    raise ValidationError(f"Невірна дата '{value}', очікується YYYY-MM-DD")
+    
+    def report(self, name, date_from=None, date_to=None, as_of=None, conn=None, job=None):
+        # (заголовки, строки) отчета из REPORT_QUERIES; job - для прогресса и отмены
+        headers, sql = REPORT_QUERIES[name]
+        self._check_period(name, sql, date_from, date_to, as_of)
+        conn = conn or self.db.connection()
+        cursor = conn.execute(sql, report_params(date_from, date_to, as_of))
+        rows = job.fetch_all(cursor) if job is not None else cursor.fetchall()
+        return headers, rows
+    
+    def export_report(self, name, path, date_from=None, date_to=None, as_of=None, conn=None, job=None):
+        headers, sql = REPORT_QUERIES[name]
+        self._check_period(name, sql, date_from, date_to, as_of)
+        return export_query(conn or self.db.connection(), sql,
+                            report_params(date_from, date_to, as_of), headers, path, job)
+    
+    def rebuild_daily_stats(self, conn=None):
+        return self.db.rebuild_daily_stats(conn)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Обслуговування бази складу без GUI")
+    parser.add_argument("--db", default="warehouse.db", help="файл бази даних")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-stats", help="перерахувати щоденні підсумки по товарах")
+    import_parser = commands.add_parser("import-products", help="імпорт товарів з CSV/XLSX")
+    import_parser.add_argument("file")
+    receipt_parser = commands.add_parser("import-receipt", help="провести надходження з файлу постачальника")
+    receipt_parser.add_argument("file")
+    receipt_parser.add_argument("--number", required=True, help="номер документу")
+    receipt_parser.add_argument("--supplier", required=True, type=int, help="id постачальника")
+    receipt_parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="дата (YYYY-MM-DD)")
+    report_parser = commands.add_parser("report", help="вивантажити звіт у CSV/XLSX")
+    report_parser.add_argument("name", choices=sorted(REPORT_QUERIES))
+    report_parser.add_argument("file")
+    report_parser.add_argument("--date-from", help="початок періоду (YYYY-MM-DD), обов'язково, крім stock")
+    report_parser.add_argument("--date-to", help="кінець періоду (YYYY-MM-DD), обов'язково, крім stock")
+    report_parser.add_argument("--as-of", help="залишки станом на дату (YYYY-MM-DD)")
+    verify_parser = commands.add_parser("verify-stock", help="звірити залишки з історією документів")
+    verify_parser.add_argument("--rebuild", action="store_true", help="виправити розбіжності")
+    snapshot_parser = commands.add_parser("snapshot-stock", help="знімки залишків на кінець місяців")
+    snapshot_parser.add_argument("--until", help="останній день знімків (YYYY-MM-DD), типово кінець минулого місяця")
+    serve_parser = commands.add_parser("serve", help="HTTP/JSON API для терміналів і сканерів")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    serve_parser.add_argument("--readers", type=int, default=4, help="потоків читання")
+    bench_parser = commands.add_parser("bench", help="заміри продуктивності на синтетичній базі")
+    bench_parser.add_argument("--scale", type=int, default=100000, help="рядків документів (10000-10000000)")
+    bench_parser.add_argument("--seed", type=int, default=1)
+    bench_parser.add_argument("--repeat", type=int, default=5, help="повторів кожного заміру")
+    bench_parser.add_argument("--output", help="файл результатів JSON")
+    bench_parser.add_argument("--compare", help="порівняти з попередніми результатами JSON")
+    bench_parser.add_argument("--data-dir", help="каталог синтетичних баз, типово bench_data")
+    bench_parser.add_argument("--profile", action="store_true",
+                              help="заміряти з профілюванням запитів і додати статистику в JSON")
+    return parser
+
+def run_command(argv):
+    args = build_parser().parse_args(argv)
+    if args.command == "bench":
+        # Своя синтетическая база - рабочий файл --db не открывается
+        from bench import run_bench, DATA_DIR
+        return run_bench(args.scale, args.seed, args.repeat, args.output, args.compare,
+                         args.data_dir or DATA_DIR, args.profile)
+    
+    # Серверу нужно по соединению на каждый поток чтения и одно для записи
+    db = Database(args.db, pool_size=args.readers + 1 if args.command == "serve" else 4)
+    service = WarehouseService(db)
+    try:
+        if args.command == "rebuild-stats":
+            rows = service.rebuild_daily_stats()
+            print(f"Щоденні підсумки перераховано: {rows} рядків")
+        elif args.command == "import-products":
+            imported, errors = service.import_products(args.file)
+            for line_no, error in errors:
+                print(f"Рядок {line_no}: {error}", file=sys.stderr)
+            print(f"Записано товарів: {imported}, рядків з помилками: {len(errors)}")
+            return 1 if errors else 0
+        elif args.command == "import-receipt":
+            receipt_id, count, errors = service.import_receipt(
+                args.file, args.number, args.supplier, args.date)
+            for line_no, error in errors:
+                print(f"Рядок {line_no}: {error}", file=sys.stderr)
+            if receipt_id is None:
+                print(f"Надходження не проведено: позицій {count}, рядків з помилками: {len(errors)}")
+                return 1
+            print(f"Надходження {args.number} проведено: позицій {count}")
+        elif args.command == "report":
+            count = service.export_report(args.name, args.file, args.date_from, args.date_to, args.as_of)
+            print(f"Експортовано рядків: {count}")
+        elif args.command == "verify-stock":
+            drift = service.rebuild_stock() if args.rebuild else service.verify_stock()
+            for _, article, name, stock, expected, reserved, expected_reserved, ledger in drift:
+                print(f"{article} {name}: залишок {stock} (за документами {expected}), "
+                      f"резерв {reserved} (за резервами {expected_reserved}), журнал {ledger}")
+            if args.rebuild:
+                print(f"Виправлено товарів: {len(drift)}")
+            else:
+                print(f"Товарів з розбіжностями: {len(drift)}")
+                return 1 if drift else 0
+        elif args.command == "snapshot-stock":
+            rows = service.checkpoint_stock(args.until)
+            print(f"Записано знімків залишків: {rows}")
+        elif args.command == "serve":
+            from server import serve
+            serve(service, args.host, args.port, args.readers)
+    except ValidationError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+if __name__ == "__main__":
+    # Через импорт, а не из __main__: server.py и bench.py импортируют warehouse,
+    # и классы исключений должны быть из того же модуля, что и у них
+    from warehouse import run_command
+    sys.exit(run_command(sys.argv[1:]))